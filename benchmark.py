@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import platform
+import resource
+import itertools
+import numpy as np
+import multiprocessing
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from src.fakeapi import WORDS
+from src.sentiment import loadBackend, predictTexts, ShardedScorer, DEFAULT_MODEL
+
+# =============================================================================
+# Throughput benchmark of the sentiment stage (see sentiment_analysis.py) on a
+# synthetic German comment corpus. Each configuration runs in a fresh process
+# (peak memory per configuration), results are written as JSON to results_file.
+# Compare results of different releases on the same hardware only.
+# =============================================================================
+
+# Model as in sentiment_analysis.py, "tiny" is a randomly initialized stand-in (no download)
+model_name = DEFAULT_MODEL
+
+# Synthetic corpus (same seed = same comments)
+n_comments = 5000
+seed = 0
+
+# Sweep (all combinations): comments per model call, token budget (see tokenBudgetBatches),
+# inference backend and (worker processes, torch threads per process). Token budget None
+# batches batch_size consecutive comments, with a budget batch_size is the upper limit.
+# 0 workers scores within the benchmark process, torch threads None = cores / worker processes.
+batch_sizes = [32, 64, 128]
+max_tokens = [None, 4096]
+backends = ["eager", "int8"]
+parallelism = [(0, 1), (0, os.cpu_count()), (2, None)]
+
+results_file = Path("benchmark_sentiment.json")
+
+def syntheticComments(n_comments, seed = 0):
+    """
+    German comment texts with a long tailed length distribution (log-normal number of
+    words, median about 10 words, few comments with several hundred words).
+    """
+
+    rng = random.Random(seed)
+    comments = []
+    for _ in range(n_comments):
+        n_words = min(600, max(1, int(rng.lognormvariate(2.3, 1.0))))
+        words = [rng.choice(WORDS) for _ in range(n_words)]
+
+        # Sentences of 4 to 15 words
+        text, sentence_length = [], 0
+        for word in words:
+            if sentence_length == 0:
+                word = word.capitalize()
+            text.append(word)
+            sentence_length += 1
+            if sentence_length >= rng.randint(4, 15):
+                text[-1] += rng.choice([".", ".", "!", "?", "!!", "..."])
+                sentence_length = 0
+        comments.append(" ".join(text))
+
+    return comments
+
+def peakRSS(who):
+    """ Peak resident memory in MB (maxrss is KB on Linux, bytes on macOS) """
+
+    maxrss = resource.getrusage(who).ru_maxrss
+    return round(maxrss / (1024**2 if sys.platform == "darwin" else 1024), 1)
+
+def runConfig(texts, batch_size, max_tokens, backend, n_workers, torch_threads):
+    """ Scores texts with one configuration (runs in its own process) """
+
+    import torch
+
+    start = time.time()
+    stats = dict()
+    if n_workers:
+        model = ShardedScorer(partial(loadBackend, backend, model_name), n_workers = n_workers,
+                              torch_threads = torch_threads)
+        torch_threads = model.torch_threads
+        # Warm up, all workers loaded their model
+        model.predictTexts(texts[:batch_size * n_workers * 2], batch_size, shard_size = batch_size, report = False)
+        score = partial(model.predictTexts, report = False)
+    else:
+        torch_threads = torch_threads or os.cpu_count()
+        torch.set_num_threads(torch_threads)
+        model = loadBackend(backend, model_name)
+        model.predict_sentiment(texts[:batch_size], True)
+        score = partial(predictTexts, sentiment_model = model, report = False)
+    startup_seconds = time.time() - start
+
+    start = time.time()
+    score(texts = texts, batch_size = batch_size, max_tokens = max_tokens, stats = stats)
+    seconds = time.time() - start
+
+    if n_workers:
+        model.close()
+
+    batch_seconds = np.array(stats["batch_seconds"])
+    return {"batch_size": batch_size,
+            "max_tokens": max_tokens,
+            "backend": backend,
+            "n_workers": n_workers,
+            "torch_threads": torch_threads,
+            "startup_seconds": round(startup_seconds, 3),
+            "seconds": round(seconds, 3),
+            "comments_per_sec": round(len(texts) / seconds, 1),
+            "batches": stats["batches"],
+            "batch_p50_ms": round(np.percentile(batch_seconds, 50) * 1000, 2),
+            "batch_p99_ms": round(np.percentile(batch_seconds, 99) * 1000, 2),
+            "padding_efficiency": round(stats["tokens"] / stats["padded_tokens"], 3),
+            "peak_rss_mb": peakRSS(resource.RUSAGE_SELF),
+            "peak_rss_worker_mb": peakRSS(resource.RUSAGE_CHILDREN) if n_workers else None}
+
+
+# Guard required, configurations and workers run in spawned processes
+if __name__ == "__main__":
+
+    import torch
+    import transformers
+
+    texts = syntheticComments(n_comments, seed)
+    n_words = np.array([len(text.split()) for text in texts])
+
+    results = {"environment": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                               "platform": platform.platform(),
+                               "processor": platform.processor(),
+                               "cpu_count": os.cpu_count(),
+                               "python": platform.python_version(),
+                               "torch": torch.__version__,
+                               "transformers": transformers.__version__,
+                               "model": model_name},
+               "corpus": {"comments": n_comments,
+                          "seed": seed,
+                          "words_p50": int(np.percentile(n_words, 50)),
+                          "words_p99": int(np.percentile(n_words, 99))},
+               "runs": []}
+
+    # Duplicates (e.g. single core machines) are run once
+    configs = list(itertools.product(batch_sizes, max_tokens, backends, dict.fromkeys(parallelism)))
+    for i, (batch_size, budget, backend, (n_workers, torch_threads)) in enumerate(configs):
+        print(f'{i+1}/{len(configs)} | batch_size {batch_size} | max_tokens {budget} | '
+              f'backend {backend} | workers {n_workers} | threads {torch_threads}')
+
+        with ProcessPoolExecutor(max_workers = 1, mp_context = multiprocessing.get_context("spawn")) as executor:
+            run = executor.submit(runConfig, texts, batch_size, budget, backend, n_workers, torch_threads).result()
+
+        print(f'{run["comments_per_sec"]} comments per sec | p50 {run["batch_p50_ms"]} ms | '
+              f'p99 {run["batch_p99_ms"]} ms | peak RSS {run["peak_rss_mb"]} MB')
+        results["runs"].append(run)
+
+        # Written after each configuration (partial results of interrupted sweeps)
+        results_file.write_text(json.dumps(results, indent = 2))
+
+    print(json.dumps(results, indent = 2))
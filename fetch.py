@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
-import os
 import shutil
 import pandas as pd
-import json
 
-from src.funcs import first_key, second_key, storage_path, project_path
+from src.funcs import storage_path, project_path, KeyPool, ParquetCommentSink, QuotaExhaustedError
 from src.funcs import getChannelMetrics, getVideoIds, getVideoStatistics, getCommentsFromVideos
+from src.funcs import getMissingVideos, getCompleteVideos, loadFiles, COMMENT_DTYPES
+from src.funcs import readTable, writeTable, channelHasComments
 
 # =============================================================================
 # Channel Ids overview
@@ -16,15 +16,18 @@ print(channels)
 # =============================================================================
 # API fetch starts with channelId (manual input)
 # Check quota limit here: # https://console.cloud.google.com/apis
+# All API_KEY_n entries of .env are used, one after another when quota is exceeded.
+# Spent quota per key is tracked in data/quota_usage.json (shared by parallel runs)
 # =============================================================================
 
-if not first_key:
+key_pool = KeyPool.fromEnv()
+if not key_pool.api_keys:
     print("no API key set")
 
 # Import Option 1 using a channelId (preferred!) 
 # Loads basic metrics and create own subfolder
 channelId = "UC4zcMHyrT_xyWlgy5WGpFFQ"
-channel_metrics, channel_foldername = getChannelMetrics(channelId, api_key_selector = first_key)
+channel_metrics, channel_foldername = getChannelMetrics(channelId, api_key_selector = key_pool)
 channel_path = storage_path.joinpath(channel_foldername)
 channel_path.mkdir(exist_ok = True)
 playlistId = channel_metrics.get("playlistId") # this list contains all videos uploaded by the channel owner
@@ -36,20 +39,30 @@ playlistId = channel_metrics.get("playlistId") # this list contains all videos u
 # channel_path = storage_path.joinpath(channel_foldername)
 # channel_path.mkdir(exist_ok = True)
 
-# Generates "all_videos.csv" within channel folder 
-raw_video_info = getVideoIds(playlistId, api_key_selector = first_key)
+# Generates "all_videos.parquet" within channel folder 
+raw_video_info = getVideoIds(playlistId, api_key_selector = key_pool)
 raw_video_info = raw_video_info[~raw_video_info["videoOwnerChannelId"].isna()]
-getVideoStatistics(raw_video_info, channel_path, api_key_selector = first_key)
+getVideoStatistics(raw_video_info, channel_path, api_key_selector = key_pool)
 
 # Import videoIds back from local storage
-all_videos = pd.read_csv(channel_path.joinpath("all_videos.csv"), 
-                         index_col = "videoId", 
-                         lineterminator="\r")
+all_videos = readTable(channel_path.joinpath("all_videos"))
 all_videos["channel_foldername"] = channel_foldername
 
 # =============================================================================
 # API comment extraction for given videoIds.
+# Videos are fetched concurrently by max_workers threads, requests per API key
+# are capped at requests_per_second.
+# With parquet_sink, each completed video is written to data/comments_dataset 
+# (channel/videoId partitions) instead of being concatenated into one csv.
 # =============================================================================
+max_workers = 8
+requests_per_second = 10
+parquet_sink = True
+
+sink = None
+if parquet_sink:
+    video_features = all_videos[["Title", "videoOwnerChannelTitle", "publishedAt"]]
+    sink = ParquetCommentSink(channel_foldername, video_features)
 
 # Remove videos with no or disabled comments
 videoIds = list(all_videos.query("commentCount.notnull()") # NULL when comments are disabled
@@ -57,69 +70,68 @@ videoIds = list(all_videos.query("commentCount.notnull()") # NULL when comments
                           .index)
 
 # If final file already exists, do nothing, otherwise start OR continue comment fetch.
-if (
-    ("all_comments_noSentiment.csv" in os.listdir(channel_path)) or 
-    ("all_comments_withSentiment.csv" in os.listdir(channel_path))
-   ):
+fetch_finished = channelHasComments(channel_path)
+
+if fetch_finished:
     print('--------------------')
-    print('csv file found')
+    print('comment table or consolidated dataset found')
     print('Comment fetch appears finished')
     
 else:
     print('--------------------')
-    # Stores only videos where all comment have been extracted
-    # Missing videosIds are dumped in local json file
-    getCommentsFromVideos(videoIds, channel_path, api_key_selector = first_key)
-    
-    # Various reasons may lead to incomplete comment extraxtions and therefore incomplete videos
-    
-    # Sometines comments are simply not fetched (two times seems sufficent)
-    if "missing_videos.json" in os.listdir(channel_path):
+    # Pages are checkpointed per video in tmp/{videoId}.json
+    # Reruns skip complete videos and resume incomplete ones at the last page.
+    # Transient errors are retried per request, videos with permanent errors 
+    # (e.g. comments disabled) are skipped. Reruns only request recoverable videos.
+    try:
+        missing_videos = getCommentsFromVideos(videoIds, channel_path, api_key_selector = key_pool,
+                                               max_workers = max_workers, 
+                                               requests_per_second = requests_per_second, sink = sink)
+        
         runs = 2
         for i in range(runs):
-            print(f"missing_videos.json found, try {i+1} ... ")
-            with open(channel_path.joinpath("missing_videos.json"), 'r') as filepath:
-                missing_videos = json.load(filepath)
-        
-            getCommentsFromVideos(missing_videos, channel_path, api_key_selector = first_key)
-
-    # If still missing, most likely no quotas are left. Try with other API key.
-    if "missing_videos.json" in os.listdir(channel_path):
-        print("missing_videos.json found, try with other API KEY ... ")
-        with open(channel_path.joinpath("missing_videos.json"), 'r') as filepath:
-            missing_videos = json.load(filepath)
-                
-        getCommentsFromVideos(missing_videos, channel_path, api_key_selector = second_key) 
-        
-    # If STILL missing, come back after daily quota reset at 9am.
-    if "missing_videos.json" in os.listdir(channel_path):
-        print("missing_videos.json found, no quotas left, no API Keys left, come back another day ... ")
+            if not missing_videos:
+                break
+            print(f"{len(missing_videos)} videos incomplete, try {i+1} ... ")
+            missing_videos = getCommentsFromVideos(missing_videos, channel_path, api_key_selector = key_pool,
+                                                   max_workers = max_workers, 
+                                                   requests_per_second = requests_per_second, sink = sink)
+    
+    # No quotas left, no API keys left. Come back after daily quota reset at 9am.
+    except QuotaExhaustedError:
+        missing_videos = getMissingVideos(videoIds, channel_path)
+        print(f"{len(missing_videos)} videos incomplete, quota usage per key: {key_pool.usage()}")
+        print("no quotas left, no API Keys left, come back another day ... ")
+
+    # Videos with permanent errors (skipped) are not part of the concatenation
+    complete_videos = getCompleteVideos(videoIds, channel_path)
 
 # =============================================================================
-# If fetch complete (= no missing_videos.json), files are concatenated into one csv 
-# including some augmentation of features from all_videos.csv 
+# If fetch complete (= all checkpoints complete) and parquet_sink is used, only 
+# the metadata of all video files is consolidated (comments are not rewritten)
 # =============================================================================
 
-if "missing_videos.json" not in os.listdir(channel_path):
+if not fetch_finished and not missing_videos and sink:
 
-    video_files = os.listdir(channel_path.joinpath("tmp"))
-        
-        # Concatenate 
-    all_comments = pd.DataFrame()
-    counter = 0
-
-    for file in video_files:
-        _ = pd.read_csv(channel_path.joinpath("tmp", file), 
-                        index_col = 0, 
-                        parse_dates = ["comment_published", "comment_update"],
-                        lineterminator='\n')
-        
-        all_comments = pd.concat([all_comments, _], axis = 0)
-        
-        progress = round( counter / len(video_files), 3)
-        print(f'Fraction concatenated: {progress}')
+    n_comments = sink.consolidate(complete_videos)
+    print(f'{channel_foldername} | {n_comments} comments of {len(complete_videos)} videos in {sink.channel_path}')
+    shutil.rmtree(channel_path.joinpath("tmp"))
+
+# =============================================================================
+# If fetch complete (= all checkpoints complete), files are concatenated into one table 
+# including some augmentation of features from all_videos 
+# =============================================================================
+
+elif not fetch_finished and not missing_videos:
+
+    video_files = [channel_path.joinpath("tmp", f'{videoId}.csv') for videoId in complete_videos]
         
-        counter += 1
+    # Concatenate (files are read in parallel and concatenated once)
+    all_comments = loadFiles(video_files,
+                             index_col = 0, 
+                             dtype = COMMENT_DTYPES,
+                             parse_dates = ["comment_published", "comment_update"],
+                             lineterminator='\n')
 
     # Augment video features
     video_features = all_videos[["Title", "videoOwnerChannelTitle", "publishedAt"]]
@@ -134,14 +146,14 @@ if "missing_videos.json" not in os.listdir(channel_path):
     all_comments_aug = all_comments_aug.drop(["comment_update"], axis = 1)
 
     # =============================================================================
-    # Data export "all_comments_noSentiment.csv" (locally)
+    # Data export "all_comments.parquet" (locally), sentiment is stored separately
     # ... and removing tmp/ folder
     # =============================================================================
 
     last_comment = all_comments_aug["comment_published"].max() # <- latest comment!
     all_comments_aug.info()
-    all_comments_aug.to_csv(channel_path.joinpath("all_comments_noSentiment.csv"), lineterminator="\r")
-    print(f'all_comments_noSentiment.csv saved | last comment within data ----> {last_comment}')
+    writeTable(all_comments_aug, channel_path.joinpath("all_comments"))
+    print(f'all_comments.parquet saved | last comment within data ----> {last_comment}')
 
     # -- User input --
     user_input = (input(f'{channel_foldername} | {len(all_comments_aug)} comments concatenated from {len(video_files)} videos. \
@@ -154,5 +166,5 @@ if "missing_videos.json" not in os.listdir(channel_path):
     else:
         print("nothing done.")
     
-else: 
-    print("Comment concatenation aborted (missing_videos.json still exists)")
\ No newline at end of file
+elif not fetch_finished: 
+    print(f"Comment concatenation aborted ({len(missing_videos)} videos still incomplete)")
\ No newline at end of file
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import tempfile
+import pandas as pd
+from pathlib import Path
+
+from src.fakeapi import serveFakeYouTube
+from src.funcs import KeyPool, readCheckpoint, getFetchOutcomes, readTable
+from src.funcs import getChannelMetrics, getVideoIds, getVideoStatistics, getCommentsFromVideos
+
+# =============================================================================
+# Offline load test of the fetch pipeline against the local fake YouTube API
+# (src/fakeapi.py). No network access and no real API quota involved.
+# =============================================================================
+
+# Synthetic channel size and injected faults (see FakeYouTube)
+config = dict(videos_per_channel = 200,
+              comments_per_video = 300,
+              reply_fanout = 0.5,
+              private_fraction = 0.02,
+              disabled_fraction = 0.05,
+              latency = 0.02,
+              quota_per_key = 800)
+
+# Server errors are only injected during the comment fetch (retry behavior)
+server_error_rate = 0.01
+max_workers = 8
+requests_per_second = None
+runs = 3
+
+def stage(name, api, func, *args, **kwargs):
+    requests_before = sum(api.requests.values())
+    start = time.time()
+    result = func(*args, **kwargs)
+    seconds = time.time() - start
+    requests = sum(api.requests.values()) - requests_before
+    results[name] = {"seconds": round(seconds, 3),
+                     "requests": requests,
+                     "requests_per_sec": round(requests / seconds, 1)}
+    return result
+
+results = dict()
+
+with serveFakeYouTube(**config) as (api_endpoint, api):
+
+    # setupYouTube() sends all requests to the local server
+    os.environ["YT_API_ENDPOINT"] = api_endpoint
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        channel_path = Path(tmp)
+        key_pool = KeyPool(["fake-key-1", "fake-key-2", "fake-key-3"],
+                           usage_file = channel_path.joinpath("quota_usage.json"))
+
+        channel_metrics, _ = stage("channel", api, getChannelMetrics, api.channelId(0), key_pool)
+        raw_video_info = stage("videoIds", api, getVideoIds, channel_metrics["playlistId"], key_pool)
+        stage("statistics", api, getVideoStatistics, raw_video_info, channel_path, key_pool)
+
+        api.server_error_rate = server_error_rate
+        all_videos = readTable(channel_path.joinpath("all_videos"))
+        # Videos with disabled comments are kept to measure skipping of permanent errors
+        videoIds = list(all_videos.index)
+
+        # Reruns resume incomplete videos (checkpoints in tmp/)
+        start = time.time()
+        for i in range(runs):
+            missing_videos = stage(f"comments_run{i+1}", api, getCommentsFromVideos,
+                                   videoIds, channel_path, key_pool,
+                                   max_workers = max_workers,
+                                   requests_per_second = requests_per_second)
+            if not missing_videos:
+                break
+        seconds = time.time() - start
+
+        outcomes = pd.Series(getFetchOutcomes(videoIds, channel_path))
+        n_comments = sum(readCheckpoint(channel_path, videoId)["rows"]
+                         for videoId in outcomes[outcomes == "complete"].index)
+
+        results["comments"] = {"seconds": round(seconds, 3),
+                               "runs": i + 1,
+                               "videos": len(videoIds),
+                               "outcomes": outcomes.value_counts().to_dict(),
+                               "comments_per_sec": round(n_comments / seconds, 1)}
+        results["quota_usage"] = key_pool.usage()
+
+print(json.dumps(results, indent = 2))
@@ -4,23 +4,20 @@ import numpy as np
 from datetime import datetime
 import plotly.express as px
 from src.funcs import processed_path, reports_path, relabeling_dict, px_select_deselect
-from src.funcs import importDFdtypes
+from src.funcs import readTable
 
 # =============================================================================
 # Load and prepare video data
 # =============================================================================
 
-# Import csv and assign correct dtypes (both videos and comments)
-videos = pd.read_csv(processed_path.joinpath("videos.csv"), 
-                     lineterminator="\r", 
-                     index_col="videoId")
-videos = videos.astype(importDFdtypes("videos.json"))
+# Import tables, dtypes are stored within (both videos and comments)
+videos = readTable(processed_path.joinpath("videos"))
 
 # Do not use comment_id as index here (replies have same comment_id as the comments they reply to)
-comments = pd.read_csv(processed_path.joinpath("comments.csv"), 
-                       lineterminator="\r", 
-                       index_col=0) 
-comments = comments.astype(importDFdtypes("comments.json"))
+# Only the comment columns used in this report are read
+comments = readTable(processed_path.joinpath("comments"),
+                     columns = ["videoId", "videoOwnerChannelTitle", "publishedAt", 
+                                "comment_published", "comment_word_count", "owner_comment"])
 
 # Only videos published before report_deadline are included in report.
 # (to avoid including videos with insufficient time to accumulate comments
@@ -176,7 +173,7 @@ for quarter in quarters:
     video_derived_metrics = (
          videos_cutoff
         .query("quarter == @quarter")
-        .groupby("videoOwnerChannelTitle")
+        .groupby("videoOwnerChannelTitle", observed=True)
         .agg({
               "quarter" : "median",
               "video_url" : "size", # column only used to sum videos (relabeled below) 
@@ -197,7 +194,7 @@ for quarter in quarters:
     comment_derived_metrics = (
          comments
         .query("quarter == @quarter")
-        .groupby("videoOwnerChannelTitle")
+        .groupby("videoOwnerChannelTitle", observed=True)
         .agg({
               "videoId" : "size", # column only used to sum comments (relabeled below) 
               "comment_word_count" : "median",
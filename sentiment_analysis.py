@@ -1,76 +1,109 @@
-import os
 import time
 import pandas as pd
-from germansentiment import SentimentModel # model details see below
-from src.funcs import storage_path
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from src.funcs import storage_path, data_path, iterChannelComments, channelHasComments
+from src.funcs import SentimentScoreStore, SCORE_KEYS
+from src.sentiment import scoreComments, SentimentCache, ShardedScorer, modelId
+from src.sentiment import loadBackend, checkAgreement, DEFAULT_MODEL
 
-sentiment = SentimentModel()
-sentiment.predict_sentiment(["Dies ist eine Teststring"], True)
+# Model "germansentiment" (see below) and inference backend: 
+# "eager" (PyTorch float32, reference) or "int8" (dynamically quantized linear layers, CPU)
+# Other backends are checked against the reference on agreement_sample comments first.
+model_name = DEFAULT_MODEL
+backend = "eager"
+agreement_sample = 1000
+
+# Comments per model call (larger batches are faster until memory becomes the limit)
+batch_size = 64
+
+# Token budget per model call: comments of similar length are batched together until
+# batch size x longest comment reaches max_tokens or batch_size comments (less padding). 
+# None batches batch_size consecutive comments.
+max_tokens = 4096
+
+# Worker processes for scoring (each loads the model once, torch threads are split 
+# between them). 0 scores within this process. Channels are analyzed parallel_channels 
+# at a time, all of them share the worker processes.
+n_workers = 4
+parallel_channels = 2
+
+# Comments read, analyzed and stored at a time (memory stays flat for large channels)
+chunk_size = 50000
 
 def sentiment_analysis(channel_path):
     """
     Executes sentiment analysis using the model "germansentiment".
 
     Parameters:
-            channel_path (list): local folder for importing required .csv files
+            channel_path (list): local folder of the channel (comments see iterChannelComments)
     Returns:
-            No returns. Sentiment is appended to DataFrame which is stored again as csv file
-            in channel_path
+            No returns. Sentiment of comments without scores so far is appended to the
+            score store of the channel (sentiment_scores/). Comments are read, analyzed and 
+            stored chunk_size at a time, an interrupted run resumes after the last stored 
+            chunk. Comments are not rewritten, thus after update.py only the new comments 
+            are analyzed.
     """
-    # Import all_comments_noSentiment.csv from channel folders 
-    comments_for_sentiment = pd.read_csv(channel_path.joinpath("all_comments_noSentiment.csv"),
-                                         index_col = 0, lineterminator="\r",
-                                         parse_dates=["publishedAt", "comment_published"],
-                                         dtype={"comment_string":"str"},)
-    
-    channel_title = comments_for_sentiment["videoOwnerChannelTitle"][0]
-    
-    # Loop for sentiment analysis
-    n_comments = len(comments_for_sentiment) # required for loop reporting
-    sentiment_estimate = ()
-    sentimentsDF = pd.DataFrame() # sentiments go here
-    print(f'Analyzing {n_comments} comments fetched from {channel_title} ...')
+    score_store = SentimentScoreStore(channel_path)
+    n_comments, n_analyzed = 0, 0
     start = time.time()
     
-    for comment in comments_for_sentiment["comment_string"]:
-        
-        _ = pd.DataFrame()
+    chunks = iterChannelComments(channel_path, chunk_size = chunk_size,
+                                 columns = SCORE_KEYS + ["comment_string", "videoOwnerChannelTitle"])
+    for i, comments in enumerate(chunks):
+        n_comments += len(comments)
+        comments_for_sentiment = comments[score_store.missing(comments)].reset_index(drop=True)
+        if comments_for_sentiment.empty:
+            continue
         
-        sentiment_estimate = sentiment.predict_sentiment([str(comment)], True)
-        _["prediction"] = sentiment_estimate[0]
-        _["positive"] = sentiment_estimate[1][0][0][1]
-        _["negative"] = sentiment_estimate[1][0][1][1]
-        _["neutral"] = sentiment_estimate[1][0][2][1]
+        # Batched sentiment analysis (batch_size comments per model call)
+        channel_title = comments_for_sentiment["videoOwnerChannelTitle"][0]
+        print(f'Analyzing {len(comments_for_sentiment)} of {len(comments)} comments fetched from {channel_title} (chunk {i+1}) ...')
+        sentimentsDF = scoreComments(comments_for_sentiment["comment_string"], sentiment, 
+                                     batch_size = batch_size, name = f'{channel_title} chunk {i+1}', 
+                                     cache = sentiment_cache, scorer = scorer, max_tokens = max_tokens)
         
-        sentimentsDF = pd.concat([sentimentsDF, _], ignore_index=True)
-        fraction_done = len(sentimentsDF) / n_comments
-        
-        # loop reporting (in per mil steps)
-        if (fraction_done) > 0.001:
-            time_per_pm = time.time()
-            time_passed = time_per_pm - start
-            print(f'{channel_title} | {round(fraction_done, 3)} done | time per loop: {round(time_passed, 3)}')
-            start = time.time()
-    
-    # Augment sentiment to original data frame and store as csv
-    comments_for_sentiment = pd.merge(comments_for_sentiment, sentimentsDF, left_index=True, right_index=True )
-    comments_for_sentiment.to_csv(channel_path.joinpath("all_comments_withSentiment.csv"), 
-                                  lineterminator="\r")
+        # Store sentiment of the chunk (keyed by comment_id, reply_id)
+        score_store.append(pd.concat([comments_for_sentiment[SCORE_KEYS], sentimentsDF], axis = 1))
+        n_analyzed += len(comments_for_sentiment)
     
-    #if new csv file exists, delete old one
-    if "all_comments_withSentiment.csv" in os.listdir(channel_path):
-        file = channel_path.joinpath("all_comments_noSentiment.csv")
-        os.remove(file)
-        print("original csv deleted.")
+    if n_analyzed == 0:
+        print(f'{channel_path.name} | all {n_comments} comments already analyzed')
+        return
+    print(f'{channel_path.name} | sentiment of {n_analyzed} of {n_comments} comments done in {round(time.time() - start, 1)} sec')
 
 
-# Loop through channels 
-channel_paths = [x for x in storage_path.iterdir() if x.is_dir()]
-for channel_path in channel_paths:
-    sentiment_analysis(channel_path)
-
-# Single channel
-channel_path = channel_paths[-3]
-sentiment_analysis(channel_path)
+# Guard required, worker processes import this file again
+if __name__ == "__main__":
+    
+    sentiment = loadBackend(backend, model_name)
+    sentiment.predict_sentiment(["Dies ist eine Teststring"], True)
+    
+    # Loop through channels (only comments without sentiment scores are analyzed)
+    channel_paths = [x for x in storage_path.iterdir() if x.is_dir() and channelHasComments(x)]
+    
+    # Agreement of optimized backend with reference backend (sample of first channel)
+    if backend != "eager" and channel_paths:
+        sample = next(iterChannelComments(channel_paths[0], columns = ["comment_string"], chunk_size = chunk_size))["comment_string"]
+        sample = sample.sample(min(agreement_sample, len(sample)), random_state = 0)
+        agreement = checkAgreement(loadBackend("eager", model_name), sentiment, sample, batch_size)
+        if not agreement["passed"]:
+            raise SystemExit(f'backend "{backend}" disagrees with reference, use backend = "eager"')
+    
+    # Scores of already analyzed texts (repeated comments, refetches) are reused
+    sentiment_cache = SentimentCache(data_path.joinpath("sentiment_cache.sqlite"), 
+                                     modelId(sentiment), max_entries = 5000000)
+    scorer = ShardedScorer(partial(loadBackend, backend, model_name), n_workers = n_workers) if n_workers else None
+    
+    # Without worker processes the model (tokenizer) is not shared between threads
+    with ThreadPoolExecutor(max_workers = parallel_channels if scorer else 1) as executor:
+        list(executor.map(sentiment_analysis, channel_paths))
+    
+    # Single channel
+    # channel_path = channel_paths[-3]
+    # sentiment_analysis(channel_path)
+    
+    if scorer:
+        scorer.close()
 
     
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the YouTube Data API (v3) used for offline load testing.
+
+Serves the list endpoints channels, playlistItems, videos and commentThreads
+with synthetic, deterministic data (same seed = same channels, videos and comments)
+and realistic pagination. Latency, quota errors (403 quotaExceeded) and server
+errors (5xx) can be injected.
+
+Point setupYouTube() at the server via environment variable, e.g.
+    YT_API_ENDPOINT=http://127.0.0.1:8765/
+
+Run standalone:
+    python -m src.fakeapi --port 8765 --videos 200 --comments 300
+"""
+import json
+import time
+import random
+import argparse
+import threading
+import pandas as pd
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+WORDS = ["ich", "finde", "das", "video", "echt", "gut", "schlecht", "danke", "für", "die",
+         "erklärung", "warum", "nicht", "wieder", "mal", "super", "interessant", "quatsch",
+         "genau", "so", "ist", "es", "leider", "bitte", "mehr", "davon", "politik", "thema",
+         "wirklich", "toll", "gemacht", "kann", "man", "nur", "zustimmen", "oder", "😂", "👍"]
+
+class FakeYouTube:
+
+    """
+    Synthetic YouTube data and request handling (independent of HTTP).
+
+            Parameters:
+                    n_channels (int): number of channels
+                    videos_per_channel (int): uploads per channel
+                    comments_per_video (int): mean number of top level comments per video
+                    reply_fanout (float): mean number of replies per top level comment
+                    private_fraction (float): videos listed in playlists but not returned by videos.list
+                    disabled_fraction (float): videos with disabled comments (403 commentsDisabled)
+                    latency (float): seconds added to each request (plus random jitter of same size)
+                    quota_error_rate (float): probability of 403 quotaExceeded per request
+                    server_error_rate (float): probability of 500/503 per request
+                    quota_per_key (int): requests per API key before quotaExceeded (None = unlimited)
+                    invalid_keys (list): API keys rejected with 400 keyInvalid
+                    seed (int): seed for synthetic data
+    """
+
+    def __init__(self, n_channels = 1, videos_per_channel = 100, comments_per_video = 200,
+                 reply_fanout = 0.5, private_fraction = 0.0, disabled_fraction = 0.0,
+                 latency = 0.0, quota_error_rate = 0.0, server_error_rate = 0.0,
+                 quota_per_key = None, invalid_keys = (), seed = 0):
+        self.n_channels = n_channels
+        self.videos_per_channel = videos_per_channel
+        self.comments_per_video = comments_per_video
+        self.reply_fanout = reply_fanout
+        self.private_fraction = private_fraction
+        self.disabled_fraction = disabled_fraction
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.server_error_rate = server_error_rate
+        self.quota_per_key = quota_per_key
+        self.invalid_keys = set(invalid_keys)
+        self.seed = seed
+
+        self.start = pd.Timestamp("2020-01-01", tz = "UTC")
+        self.requests = dict()      # number of requests per API key
+        self.lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    # Synthetic data (derived from ids, nothing is stored)
+    # -------------------------------------------------------------------------
+
+    def rng(self, *key):
+        return random.Random("-".join(str(x) for x in (self.seed,) + key))
+
+    @staticmethod
+    def timestamp(ts):
+        return ts.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def channelId(self, c):
+        return f'UCfake{c:018d}'
+
+    def videoId(self, c, v):
+        return f'v{c:03d}{v:07d}'
+
+    def parseVideoId(self, videoId):
+        try:
+            c, v = int(videoId[1:4]), int(videoId[4:])
+        except ValueError:
+            return None
+        if c < self.n_channels and v < self.videos_per_channel:
+            return c, v
+        return None
+
+    def channel(self, c):
+        return {
+            "id": self.channelId(c),
+            "snippet": {"title": f'Fake Channel {c}',
+                        "publishedAt": self.timestamp(self.start)},
+            "contentDetails": {"relatedPlaylists": {"uploads": "UU" + self.channelId(c)[2:]}},
+            "statistics": {"viewCount": str(self.rng(c).randint(10**5, 10**8)),
+                           "subscriberCount": str(self.rng(c).randint(10**3, 10**6)),
+                           "hiddenSubscriberCount": False,
+                           "videoCount": str(self.videos_per_channel)},
+        }
+
+    def videoPublished(self, c, v):
+        return self.start + pd.Timedelta(days = 2 * v, hours = self.rng(c, v).randint(0, 23))
+
+    def nThreads(self, c, v):
+        return self.rng(c, v, "threads").randint(0, 2 * self.comments_per_video)
+
+    def nReplies(self, videoId, t):
+        rng = self.rng(videoId, t, "replies")
+        return int(rng.expovariate(1 / self.reply_fanout)) if self.reply_fanout else 0
+
+    def isPrivate(self, c, v):
+        return self.rng(c, v, "private").random() < self.private_fraction
+
+    def isDisabled(self, c, v):
+        return self.rng(c, v, "disabled").random() < self.disabled_fraction
+
+    def text(self, rng):
+        n_words = max(1, int(rng.lognormvariate(2.3, 0.9)))
+        return " ".join(rng.choice(WORDS) for _ in range(n_words))
+
+    def video(self, c, v):
+        rng = self.rng(c, v)
+        videoId = self.videoId(c, v)
+        n_comments = sum(1 + self.nReplies(videoId, t) for t in range(self.nThreads(c, v)))
+        return {
+            "id": videoId,
+            "snippet": {"publishedAt": self.timestamp(self.videoPublished(c, v)),
+                        "channelId": self.channelId(c),
+                        "title": f'Fake Video {v} of channel {c}',
+                        "description": self.text(rng),
+                        "categoryId": str(rng.choice([22, 24, 25, 27]))},
+            "contentDetails": {"duration": f'PT{rng.randint(1, 59)}M{rng.randint(0, 59)}S',
+                               "definition": "hd"},
+            "statistics": {"viewCount": str(rng.randint(10**3, 10**6)),
+                           "likeCount": str(rng.randint(10, 10**4)),
+                           "favoriteCount": "0",
+                           "commentCount": str(0 if self.isDisabled(c, v) else n_comments)},
+        }
+
+    def comment(self, videoId, commentId, published, parentId = None):
+        rng = self.rng(commentId)
+        snippet = {"videoId": videoId,
+                   "authorDisplayName": f'@user{rng.randint(0, 5 * self.comments_per_video)}',
+                   "likeCount": int(rng.expovariate(0.2)),
+                   "publishedAt": self.timestamp(published),
+                   "updatedAt": self.timestamp(published),
+                   "textDisplay": self.text(rng)}
+        if parentId:
+            snippet["parentId"] = parentId
+        return {"id": commentId, "snippet": snippet}
+
+    def thread(self, c, v, t):
+        videoId = self.videoId(c, v)
+        threadId = f'Ug{videoId}t{t:07d}'
+        published = self.videoPublished(c, v) + pd.Timedelta(minutes = t ** 1.5)
+        n_replies = self.nReplies(videoId, t)
+
+        item = {"id": threadId,
+                "snippet": {"videoId": videoId,
+                            "totalReplyCount": n_replies,
+                            "topLevelComment": self.comment(videoId, threadId, published)}}
+
+        # commentThreads includes at most 5 replies per thread (as the real API)
+        if n_replies:
+            item["replies"] = {"comments": [
+                self.comment(videoId, f'{threadId}.r{r}',
+                             published + pd.Timedelta(minutes = 10 * (r + 1)), threadId)
+                for r in range(min(n_replies, 5))]}
+        return item
+
+    # -------------------------------------------------------------------------
+    # Request handling
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def error(code, reason, message):
+        return code, {"error": {"code": code, "message": message,
+                                "errors": [{"reason": reason, "message": message}]}}
+
+    @staticmethod
+    def page(items, params, default_size = 5):
+
+        # pageToken is the offset of the first item
+        size = min(int(params.get("maxResults", default_size)), 50)
+        offset = int(params.get("pageToken", "0"))
+        response = {"pageInfo": {"totalResults": len(items), "resultsPerPage": size},
+                    "items": items[offset:offset + size]}
+        if offset + size < len(items):
+            response["nextPageToken"] = str(offset + size)
+        return response
+
+    def handle(self, resource, params):
+        """Returns (status code, response dict) for a list request."""
+
+        api_key = params.get("key")
+        if not api_key or api_key in self.invalid_keys:
+            return self.error(400, "keyInvalid", "Bad Request")
+
+        with self.lock:
+            self.requests[api_key] = self.requests.get(api_key, 0) + 1
+            n_requests = self.requests[api_key]
+
+        if self.latency:
+            time.sleep(self.latency * (1 + random.random()))
+
+        if self.quota_per_key is not None and n_requests > self.quota_per_key:
+            return self.error(403, "quotaExceeded", "The request cannot be completed because you have exceeded your quota.")
+        if random.random() < self.quota_error_rate:
+            return self.error(403, "quotaExceeded", "The request cannot be completed because you have exceeded your quota.")
+        if random.random() < self.server_error_rate:
+            return self.error(random.choice([500, 503]), "backendError", "Backend Error")
+
+        handler = {"channels": self.listChannels, "playlistItems": self.listPlaylistItems,
+                   "videos": self.listVideos, "commentThreads": self.listCommentThreads}.get(resource)
+        if not handler:
+            return self.error(404, "notFound", f'Unknown resource {resource}')
+        return handler(params)
+
+    def listChannels(self, params):
+        channelIds = [self.channelId(c) for c in range(self.n_channels)]
+        items = [self.channel(channelIds.index(x)) for x in params.get("id", "").split(",") if x in channelIds]
+        return 200, {"items": items}
+
+    def listPlaylistItems(self, params):
+        playlistIds = ["UU" + self.channelId(c)[2:] for c in range(self.n_channels)]
+        playlistId = params.get("playlistId")
+        if playlistId not in playlistIds:
+            return self.error(404, "playlistNotFound", "Playlist not found")
+
+        c = playlistIds.index(playlistId)
+        items = [{"snippet": {"playlistId": playlistId,
+                              "title": f'Fake Video {v} of channel {c}',
+                              "publishedAt": self.timestamp(self.videoPublished(c, v)),
+                              "resourceId": {"videoId": self.videoId(c, v)},
+                              "videoOwnerChannelId": self.channelId(c),
+                              "videoOwnerChannelTitle": f'Fake Channel {c}'}}
+                 for v in reversed(range(self.videos_per_channel))]
+        return 200, self.page(items, params)
+
+    def listVideos(self, params):
+        # As the real API: maxResults is not supported in combination with id
+        if "id" in params and "maxResults" in params:
+            return self.error(400, "incompatibleParameters", "The maxResults parameter cannot be used with the id parameter.")
+
+        items = []
+        for videoId in params.get("id", "").split(","):
+            parsed = self.parseVideoId(videoId)
+            if parsed and not self.isPrivate(*parsed):
+                items.append(self.video(*parsed))
+        return 200, {"items": items}
+
+    def listCommentThreads(self, params):
+        parsed = self.parseVideoId(params.get("videoId", ""))
+        if not parsed:
+            return self.error(404, "videoNotFound", "The video identified by the videoId parameter could not be found.")
+        if self.isDisabled(*parsed):
+            return self.error(403, "commentsDisabled", "The video has disabled comments.")
+
+        # Only the requested page is generated, order=time returns newest first
+        n_threads = self.nThreads(*parsed)
+        size = min(int(params.get("maxResults", 20)), 100)
+        offset = int(params.get("pageToken", "0"))
+        indices = range(offset, min(offset + size, n_threads))
+        if params.get("order") == "time":
+            indices = [n_threads - 1 - t for t in indices]
+
+        response = {"pageInfo": {"totalResults": n_threads, "resultsPerPage": size},
+                    "items": [self.thread(*parsed, t) for t in indices]}
+        if offset + size < n_threads:
+            response["nextPageToken"] = str(offset + size)
+        return 200, response
+
+class FakeYouTubeHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        resource = url.path.rstrip("/").split("/")[-1]
+        status, response = self.server.api.handle(resource, dict(parse_qsl(url.query)))
+
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@contextmanager
+def serveFakeYouTube(host = "127.0.0.1", port = 0, **config):
+    """
+    Runs a FakeYouTube server in a background thread.
+
+            Parameters:
+                    host (str): interface to bind
+                    port (int): port (0 picks a free port)
+                    **config: see FakeYouTube
+            Yields:
+                    api_endpoint (str): url to be used as YT_API_ENDPOINT
+                    api (FakeYouTube): the served instance (e.g. for request counts)
+    """
+
+    server = ThreadingHTTPServer((host, port), FakeYouTubeHandler)
+    server.daemon_threads = True
+    server.api = FakeYouTube(**config)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+
+    try:
+        yield f'http://{host}:{server.server_address[1]}/', server.api
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Local fake YouTube Data API")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--channels", type = int, default = 1)
+    parser.add_argument("--videos", type = int, default = 100)
+    parser.add_argument("--comments", type = int, default = 200)
+    parser.add_argument("--replies", type = float, default = 0.5)
+    parser.add_argument("--latency", type = float, default = 0.0)
+    parser.add_argument("--quota-error-rate", type = float, default = 0.0)
+    parser.add_argument("--server-error-rate", type = float, default = 0.0)
+    parser.add_argument("--quota-per-key", type = int, default = None)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeYouTubeHandler)
+    server.api = FakeYouTube(n_channels = args.channels, videos_per_channel = args.videos,
+                             comments_per_video = args.comments, reply_fanout = args.replies,
+                             latency = args.latency, quota_error_rate = args.quota_error_rate,
+                             server_error_rate = args.server_error_rate,
+                             quota_per_key = args.quota_per_key)
+
+    print(f'Fake YouTube API serving at http://{args.host}:{args.port}/ '
+          f'(channelIds {server.api.channelId(0)} ... {server.api.channelId(args.channels - 1)})')
+    server.serve_forever()
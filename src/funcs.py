@@ -1,17 +1,32 @@
 #!/usr/bin/env python3
 import os
+import re
 import json
+import time
+import fcntl
+import random
+import shutil
+import socket
+import hashlib
+import threading
+import httplib2
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qsl, urlencode
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 
-# load .env entries as environment variables
+# load .env entries as environment variables (API_KEY_1, API_KEY_2, ...)
 # NOTE: .env needs to be filled manually
 dotenv_path = find_dotenv()
 load_dotenv(dotenv_path)
-first_key = os.environ.get("API_KEY_1")
-second_key = os.environ.get("API_KEY_2")
 
 # Define locations for downloads and reports) 
 project_path = Path(os.getcwd())
@@ -28,22 +43,496 @@ processed_path.mkdir(exist_ok=True)
 reports_path = data_path.joinpath("reports") 
 reports_path.mkdir(exist_ok = True)
 
+# Parquet dataset of fetched comments, partitioned by channel and videoId
+dataset_path = data_path.joinpath("comments_dataset")
+
+# =============================================================================
+# Record accumulation (column-wise, turned into a DataFrame once)
+# =============================================================================
+
+class ColumnAccumulator:
+    
+    """
+    Collects API records (dicts) column by column. Appending is O(1) per row, 
+    the DataFrame is built once via toFrame() instead of growing it row by row.
+    Keys missing in a record are stored as None, unknown keys are ignored.
+    
+            Parameters:
+                    columns (list): column names (also defines column order)
+    """
+    
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.clear()
+        
+    def __len__(self):
+        return len(self.data[self.columns[0]])
+    
+    def append(self, record):
+        for column in self.columns:
+            self.data[column].append(record.get(column))
+            
+    def clear(self):
+        self.data = {column: [] for column in self.columns}
+        
+    def toFrame(self):
+        return pd.DataFrame(self.data, columns=self.columns)
+
+# =============================================================================
+# API key pool with quota accounting
+# =============================================================================
+
+class QuotaExhaustedError(Exception):
+    """Raised when the daily quota of all API keys in a KeyPool is used up (or keys are unusable)."""
+
+class KeyPool:
+    
+    """
+    Hands out API keys and counts the quota units spent per key. Keys are used in 
+    the given order, a key is skipped once YouTube reports its quota as exceeded 
+    (or the daily_quota is reached) or rejects the key itself (e.g. keyInvalid). Usage is 
+    persisted in usage_file (shared by all processes, guarded by a file lock) until the 
+    daily quota reset (midnight Pacific Time).
+    Keys are stored as hashes only.
+    
+            Parameters:
+                    api_keys (list): YouTube API keys
+                    usage_file (PosixPath): json file for quota usage 
+                    daily_quota (int): quota units available per key and day
+    """
+    
+    def __init__(self, api_keys, usage_file = None, daily_quota = 10000):
+        self.api_keys = [api_key for api_key in api_keys if api_key]
+        self.usage_file = usage_file or data_path.joinpath("quota_usage.json")
+        self.daily_quota = daily_quota
+        self.lock = threading.Lock()
+        
+    @classmethod
+    def fromEnv(cls, **kwargs):
+        """Builds a KeyPool from all API_KEY_n environment variables (ordered by n)."""
+        
+        env_keys = [key for key in os.environ if re.fullmatch(r"API_KEY_\d+", key)]
+        env_keys = sorted(env_keys, key = lambda key: int(key.split("_")[-1]))
+        return cls([os.environ[key] for key in env_keys], **kwargs)
+    
+    @staticmethod
+    def keyId(api_key):
+        return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    
+    def _updateUsage(self, update = None):
+        
+        # Read-modify-write of usage_file while holding an exclusive lock
+        with self.lock, open(self.usage_file.with_suffix(".lock"), 'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            
+            # Quota resets at midnight Pacific Time
+            today = str(pd.Timestamp.now(tz = "America/Los_Angeles").date())
+            usage = {"date": today, "keys": dict()}
+            if self.usage_file.exists():
+                with open(self.usage_file, 'r') as filepath:
+                    usage = json.load(filepath)
+            if usage["date"] != today:
+                usage = {"date": today, "keys": dict()}
+            
+            if update:
+                update(usage["keys"])
+                with open(self.usage_file.with_suffix(".json.part"), 'w') as filepath:
+                    json.dump(usage, filepath)
+                os.replace(self.usage_file.with_suffix(".json.part"), self.usage_file)
+            
+            return usage["keys"]
+    
+    def currentKey(self):
+        """Returns the first API key with quota left, raises QuotaExhaustedError otherwise."""
+        
+        usage = self._updateUsage()
+        for api_key in self.api_keys:
+            key_usage = usage.get(self.keyId(api_key), {"units": 0, "exhausted": False})
+            if (not key_usage["exhausted"] and not key_usage.get("unusable") 
+                and key_usage["units"] < self.daily_quota):
+                return api_key
+            
+        raise QuotaExhaustedError(f"No quota left for any of {len(self.api_keys)} API keys (exhausted or rejected)")
+    
+    def spend(self, api_key, units = 1):
+        """Adds spent quota units to api_key."""
+        
+        def update(keys):
+            key_usage = keys.setdefault(self.keyId(api_key), {"units": 0, "exhausted": False})
+            key_usage["units"] += units
+        self._updateUsage(update)
+        
+    def markExhausted(self, api_key):
+        """Marks api_key as exhausted until the next quota reset."""
+        
+        def update(keys):
+            key_usage = keys.setdefault(self.keyId(api_key), {"units": 0, "exhausted": False})
+            key_usage["exhausted"] = True
+        self._updateUsage(update)
+        print(f"Quota exceeded for API key {self.keyId(api_key)}, switching to next key")
+    
+    def markUnusable(self, api_key, reason):
+        """Marks api_key as unusable (rejected by the API, e.g. keyInvalid) until the next quota reset."""
+        
+        def update(keys):
+            key_usage = keys.setdefault(self.keyId(api_key), {"units": 0, "exhausted": False})
+            key_usage["unusable"] = reason
+        self._updateUsage(update)
+        print(f"API key {self.keyId(api_key)} rejected ({reason}), switching to next key")
+        
+    def usage(self):
+        """Returns spent units per API key (hashed) for today."""
+        
+        usage = self._updateUsage()
+        return {self.keyId(api_key): usage.get(self.keyId(api_key), {"units": 0})["units"] 
+                for api_key in self.api_keys}
+
+def asKeyPool(api_key_selector):
+    """Wraps a single API key (str) into a KeyPool, KeyPools are returned unchanged."""
+    
+    if isinstance(api_key_selector, KeyPool):
+        return api_key_selector
+    return KeyPool([api_key_selector])
+
+def getErrorReason(error):
+    """Returns the reason (e.g. 'quotaExceeded') of a googleapiclient HttpError."""
+    
+    try:
+        content = json.loads(error.content.decode("utf-8"))
+        return content["error"]["errors"][0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+# =============================================================================
+# Retry policy (error classification and exponential backoff)
+# =============================================================================
+
+QUOTA_REASONS = {"quotaExceeded", "dailyLimitExceeded"}
+TRANSIENT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "backendError", "internalError"}
+
+# Problems of the API key (or its project), not of the requested resource
+KEY_REASONS = {"keyInvalid", "keyExpired", "accessNotConfigured", "ipRefererBlocked"}
+
+# Problems of a single video, playlist or channel (retry is pointless, others are fine),
+# "forbidden" e.g. for members-only or private videos
+PERMANENT_REASONS = {"commentsDisabled", "forbidden", "videoNotFound", "playlistNotFound", 
+                     "playlistItemsNotAccessible", "channelNotFound", "commentThreadNotFound"}
+
+# Connection problems below the HTTP level are always worth a retry
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, socket.timeout, httplib2.HttpLib2Error)
+
+def classifyError(error):
+    """
+    Classifies a googleapiclient HttpError as
+        'quota'      quota of the API key exceeded (switch key or stop)
+        'key'        API key rejected, e.g. keyInvalid, accessNotConfigured (switch key or stop)
+        'transient'  5xx, 429 and rate limits (retry with backoff)
+        'permanent'  requested video (playlist, channel) not available, e.g. commentsDisabled, 
+                     videoNotFound (retry is pointless)
+        'error'      anything else (raised, no retry, nothing is marked as permanently failed)
+    """
+    
+    reason = getErrorReason(error)
+    if reason in QUOTA_REASONS:
+        return "quota"
+    if reason in KEY_REASONS:
+        return "key"
+    if reason in TRANSIENT_REASONS or error.resp.status >= 500 or error.resp.status == 429:
+        return "transient"
+    if reason in PERMANENT_REASONS:
+        return "permanent"
+    return "error"
+
+class RetryPolicy:
+    
+    """
+    Exponential backoff with full jitter for transient errors: before retry n, 
+    sleeps a random time between 0 and min(max_delay, base_delay * 2**n) seconds.
+    
+            Parameters:
+                    max_retries (int): retries per request before the error is raised
+                    base_delay (float): seconds, upper bound of the first delay
+                    max_delay (float): seconds, upper bound of all delays
+    """
+    
+    def __init__(self, max_retries = 5, base_delay = 1, max_delay = 60):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+# =============================================================================
+# HTTP response cache (record / replay) for YouTube API requests
+# Opt-in via environment variables (e.g. in .env):
+#   YT_HTTP_CACHE=record    serve from cache, request (and store) on cache miss
+#   YT_HTTP_CACHE=replay    serve only from cache, raise CacheMissError on cache miss
+#   YT_HTTP_CACHE_TTL=24    hours until an entry is requested again (record mode)
+# =============================================================================
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a request is not found in the HTTP cache."""
+
+class CachedHttp:
+    
+    """
+    Wraps httplib2.Http (used by googleapiclient) with an on-disk response cache. 
+    Successful GET responses are stored as json files, keyed by method, endpoint and 
+    sorted query parameters (incl. pageToken, excl. API key). Served responses set 
+    from_cache, used to skip quota accounting (see executeRequest()).
+    
+            Parameters:
+                    cache_path (PosixPath): folder for cached responses
+                    mode (str): 'record' or 'replay' (see above)
+                    ttl (float): hours until entries expire (ignored in replay mode)
+                    http (httplib2.Http): transport used for cache misses
+    """
+    
+    def __init__(self, cache_path, mode = "record", ttl = 24, http = None):
+        self.cache_path = cache_path
+        self.cache_path.mkdir(parents = True, exist_ok = True)
+        self.mode = mode
+        self.ttl = ttl * 3600
+        self.http = http or httplib2.Http()
+        self.from_cache = False
+        
+    @staticmethod
+    def cacheKey(method, uri):
+        url = urlsplit(uri)
+        params = sorted((k, v) for k, v in parse_qsl(url.query) if k != "key")
+        request = f'{method} {url.netloc}{url.path}?{urlencode(params)}'
+        return hashlib.sha256(request.encode()).hexdigest()
+        
+    def request(self, uri, method = "GET", body = None, headers = None, **kwargs):
+        
+        self.from_cache = False
+        if method != "GET":
+            return self.http.request(uri, method, body = body, headers = headers, **kwargs)
+        
+        file = self.cache_path.joinpath(f'{self.cacheKey(method, uri)}.json')
+        if file.exists():
+            with open(file, 'r') as filepath:
+                entry = json.load(filepath)
+            if self.mode == "replay" or time.time() - entry["time"] < self.ttl:
+                self.from_cache = True
+                return httplib2.Response(entry["headers"]), entry["content"].encode("utf-8")
+        
+        if self.mode == "replay":
+            raise CacheMissError(f'{method} {urlsplit(uri).path} not found in {self.cache_path}')
+        
+        resp, content = self.http.request(uri, method, body = body, headers = headers, **kwargs)
+        
+        # Only successful responses are stored (errors are requested again)
+        if resp.status == 200:
+            entry = {"time": time.time(), "headers": dict(resp), "content": content.decode("utf-8")}
+            with open(file.with_suffix(".json.part"), 'w') as filepath:
+                json.dump(entry, filepath)
+            os.replace(file.with_suffix(".json.part"), file)
+            
+        return resp, content
+    
+    def evictExpired(self):
+        """Deletes all expired cache entries. Returns number of deleted entries."""
+        
+        n_evicted = 0
+        for file in self.cache_path.glob("*.json"):
+            with open(file, 'r') as filepath:
+                entry = json.load(filepath)
+            if time.time() - entry["time"] >= self.ttl:
+                os.remove(file)
+                n_evicted += 1
+        return n_evicted
+    
+    def close(self):
+        self.http.close()
+
+def setupHttp():
+    """
+    Returns a new HTTP transport (httplib2.Http keeps connections alive per host).
+    Wrapped by CachedHttp if enabled via YT_HTTP_CACHE (see above).
+    """
+    
+    http = httplib2.Http(timeout = 60)
+    
+    mode = os.environ.get("YT_HTTP_CACHE")
+    if not mode:
+        return http
+    
+    ttl = float(os.environ.get("YT_HTTP_CACHE_TTL", 24))
+    return CachedHttp(data_path.joinpath("http_cache"), mode = mode, ttl = ttl, http = http)
+
+# =============================================================================
+# YouTube instances and HTTP transports (reused across calls)
+# =============================================================================
+
+# Discovery document bundled with googleapiclient (no request, parsed only once)
+_discovery_document = json.loads(get_static_doc("youtube", "v3"))
+
 # Functions for YouTube API requests
-def setupYouTube(api_key_selector):
+def setupYouTube(api_key_selector, http = None):
 
     """
     Build YouTube instance (Version 3) with account-related API key.
     Requires API key stored in /project_path/.env
+    Uses the static discovery document, see getYouTube() for reused instances.
+    Responses are cached on disk if enabled via YT_HTTP_CACHE (see CachedHttp).
+    Requests are sent to YT_API_ENDPOINT if set (e.g. local fake API, see src/fakeapi.py).
     
             Parameters:
-                api_key_selector (str): choose between 'first_key' or 'second_key'
+                api_key_selector (str or KeyPool): API key or KeyPool (uses its current key)
+                http (httplib2.Http): optional transport, default: new one from setupHttp()
             Return: 
                 youtube (googleapiclient.discovery.Resource): youtube request instance
     """
     
-    youtube = build(serviceName="youtube", version="v3", developerKey = api_key_selector)
+    if isinstance(api_key_selector, KeyPool):
+        api_key_selector = api_key_selector.currentKey()
+    
+    client_options = None
+    if os.environ.get("YT_API_ENDPOINT"):
+        client_options = {"api_endpoint": os.environ["YT_API_ENDPOINT"]}
+    
+    youtube = build_from_document(_discovery_document, developerKey = api_key_selector,
+                                  http = http or setupHttp(), client_options = client_options)
     return youtube
 
+# One YouTube instance per API key (process-wide). Requests are executed with the 
+# transport of the calling thread, because httplib2.Http is not thread-safe.
+_clients = dict()
+_clients_lock = threading.Lock()
+_thread_http = threading.local()
+
+def getYouTube(api_key_selector):
+
+    """
+    Returns the YouTube instance of an API key (built once, then reused).
+    Execute its requests with threadHttp(), e.g. request.execute(http = threadHttp()).
+    
+            Parameters:
+                api_key_selector (str): API key
+            Return: 
+                youtube (googleapiclient.discovery.Resource): youtube request instance
+    """
+    
+    with _clients_lock:
+        if api_key_selector not in _clients:
+            _clients[api_key_selector] = setupYouTube(api_key_selector, threadHttp())
+        return _clients[api_key_selector]
+
+def threadHttp():
+    """Returns the HTTP transport of the calling thread (shared by all API keys, keep-alive)."""
+    
+    if not hasattr(_thread_http, "http"):
+        _thread_http.http = setupHttp()
+    return _thread_http.http
+
+class RateLimiter:
+    
+    """
+    Spaces out requests evenly (thread-safe). Each call of wait() reserves the next 
+    free time slot and sleeps until it is reached.
+    
+            Parameters:
+                    requests_per_second (float): maximum request rate
+    """
+    
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+        
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(slot - now)
+
+# One limiter per API key, shared by all threads using that key
+_rate_limiters = dict()
+_rate_limiters_lock = threading.Lock()
+
+def getRateLimiter(api_key_selector, requests_per_second):
+    
+    """
+    Returns the RateLimiter shared by all requests using the given API key.
+    
+            Parameters:
+                    api_key_selector (str): API key
+                    requests_per_second (float): maximum request rate (set on first call)
+            Returns:
+                    limiter (RateLimiter)
+    """
+    
+    with _rate_limiters_lock:
+        if api_key_selector not in _rate_limiters:
+            _rate_limiters[api_key_selector] = RateLimiter(requests_per_second)
+        return _rate_limiters[api_key_selector]
+
+def executeRequest(key_pool, resource, requests_per_second = None, units = 1, 
+                   retry_policy = None, **params):
+    
+    """
+    Executes a list request (e.g. youtube.videos().list(**params)) with the current key of
+    key_pool. Spent quota units are counted per key. Errors are handled by class 
+    (see classifyError()): if the quota of a key is exceeded (or the key is rejected), the request is repeated 
+    with the next key (QuotaExhaustedError when none is left); transient errors are 
+    retried according to retry_policy; other errors are raised right away.
+    
+            Parameters:
+                    key_pool (KeyPool): API keys
+                    resource (str): API resource, e.g. 'videos' or 'commentThreads'
+                    requests_per_second (float): optional request rate cap per API key
+                    units (int): quota costs of the request (list requests cost 1 unit)
+                    retry_policy (RetryPolicy): optional, default RetryPolicy()
+                    **params: parameters of the list request
+            Returns:
+                    response (dict): API response
+    """
+    
+    retry_policy = retry_policy or RetryPolicy()
+    attempt = 0
+    
+    while True:
+        api_key = key_pool.currentKey()
+        youtube = getYouTube(api_key)
+        http = threadHttp()
+        
+        if requests_per_second:
+            getRateLimiter(api_key, requests_per_second).wait()
+            
+        request = getattr(youtube, resource)().list(**params)
+        try:
+            response = request.execute(http = http)
+        except HttpError as error:
+            error_class = classifyError(error)
+            if error_class == "quota":
+                key_pool.markExhausted(api_key)
+                continue
+            if error_class == "key":
+                key_pool.markUnusable(api_key, getErrorReason(error))
+                continue
+            key_pool.spend(api_key, units)
+            if error_class != "transient" or attempt >= retry_policy.max_retries:
+                raise
+            reason = getErrorReason(error) or error.resp.status
+        except TRANSIENT_ERRORS as error:
+            if attempt >= retry_policy.max_retries:
+                raise
+            reason = type(error).__name__
+        else:
+            # Responses served from the HTTP cache cost no quota
+            if not getattr(http, "from_cache", False):
+                key_pool.spend(api_key, units)
+            return response
+        
+        delay = retry_policy.delay(attempt)
+        print(f'{resource} request failed ({reason}), retry {attempt+1} in {round(delay, 1)}s')
+        time.sleep(delay)
+        attempt += 1
+
+
 def getChannelMetrics(channelId, api_key_selector):
 
     """
@@ -51,16 +540,16 @@ def getChannelMetrics(channelId, api_key_selector):
     
             Parameters:
                     channelId (str): valid YouTube channelId    
-                    api_key_selector (str): choose between 'first_key' or 'second_key'
+                    api_key_selector (str or KeyPool): API key or KeyPool
             Returns:
                     channel (dict): stores basic channel info
                     channel_foldername (str): name used to create local folder
     """
     
     # Request channel infos
-    youtube = setupYouTube(api_key_selector)
-    channel_request = youtube.channels().list(part="snippet, statistics, contentDetails", id=channelId)
-    channel_response = channel_request.execute()
+    key_pool = asKeyPool(api_key_selector)
+    channel_response = executeRequest(key_pool, "channels", 
+                                      part="snippet, statistics, contentDetails", id=channelId)
     
     # Strore channel metrics in dictionary
     channel = dict()
@@ -82,33 +571,31 @@ def getVideoIds(playlistId, api_key_selector):
     
             Parameters:
                     playlistId (str): valid YouTube playlistId (e.g. upload playlist)     
-                    api_key_selector (str): choose between 'first_key' or 'second_key'
+                    api_key_selector (str or KeyPool): API key or KeyPool
             Returns:
                     raw_video_info (DataFrame): videoIds from given playlists and some additional info                                   
     """
     
-    # Instantiate youtube instance with given api_key_selector
-    youtube = setupYouTube(api_key_selector)
+    key_pool = asKeyPool(api_key_selector)
     
-    # Data frame populated in while loop below
-    raw_video_info = pd.DataFrame(columns=["videoId", "Title", "playlistId", 
-                                           "videoOwnerChannelId", "videoOwnerChannelTitle"])
+    # Columns populated in while loop below
+    raw_video_info = ColumnAccumulator(["videoId", "Title", "playlistId", 
+                                        "videoOwnerChannelId", "videoOwnerChannelTitle"])
 
     # Loop breaks when no nextPageToken is generated
     nextPageToken = None
     while True:
 
-        # Set up request
-        videos_request = youtube.playlistItems().list(
+        # Execute request
+        videos_response = executeRequest(
+            key_pool,
+            "playlistItems",
             part="snippet",
             playlistId=playlistId,
             maxResults=50,
             pageToken=nextPageToken,
         )
 
-        # Execute request
-        videos_response = videos_request.execute()
-
         # Loop through "items" to get videoId and title
         for item in videos_response["items"]:
                 
@@ -123,36 +610,38 @@ def getVideoIds(playlistId, api_key_selector):
                 video["videoOwnerChannelId"] = item["snippet"]["videoOwnerChannelId"]
                 video["videoOwnerChannelTitle"] = item["snippet"]["videoOwnerChannelTitle"]
             
-            _ = len(raw_video_info)
-            raw_video_info.loc[_] = video
+            raw_video_info.append(video)
 
         nextPageToken = videos_response.get("nextPageToken")
 
         if not nextPageToken:
             break
         
-    print(f'{len(raw_video_info)} videos found for {video["videoOwnerChannelTitle"]}')        
+    raw_video_info = raw_video_info.toFrame()
+    print(f'{len(raw_video_info)} videos found for {video.get("videoOwnerChannelTitle")}')        
     return raw_video_info
 
-def getVideoStatistics(raw_video_info, channel_path, api_key_selector):
+def getVideoStatistics(raw_video_info, channel_path, api_key_selector, batch_size = 50):
     
     """
     Augments additional video metrics to DataFrame generated by getVideoIds().
+    Up to 50 videoIds are requested per API call (comma-joined), which reduces 
+    round trips and quota costs by the same factor.
     
             Parameters:
                     raw_video_info (DataFrame): contains videoIds required for loop 
                     channel_path (list): channel-specific folder path   
-                    api_key_selector (str): choose between 'first_key' or 'second_key'
+                    api_key_selector (str or KeyPool): API key or KeyPool
+                    batch_size (int): videoIds per request (API maximum is 50)
             Returns:
-                    No returns. video metrics are stored in /{channel_path}/all_videos.csv                                
+                    No returns. video metrics are stored in /{channel_path}/all_videos.parquet                                
     """
     
-    # Instantiate youtube instance with given api_key_selector
-    youtube = setupYouTube(api_key_selector)
+    key_pool = asKeyPool(api_key_selector)
     
-    # Data frame filled in loop below
-    all_metrics = pd.DataFrame(
-        columns=[
+    # Columns filled in loop below
+    all_metrics = ColumnAccumulator(
+        [
             "viewCount",
             "likeCount",
             "commentCount",
@@ -165,252 +654,1234 @@ def getVideoStatistics(raw_video_info, channel_path, api_key_selector):
         ]
     )
     
-    # Variables for loop reporting
-    counter, d = 0,0
-    
-    for videoId in raw_video_info["videoId"]:
+    # API accepts at most 50 ids per videos.list call
+    batch_size = min(batch_size, 50)
+    videoIds = list(raw_video_info["videoId"])
+    missing_videos = []
     
-        video_request = youtube.videos().list(
-            part="snippet, contentDetails, statistics", id=videoId
+    for i in range(0, len(videoIds), batch_size):
+        
+        batch = videoIds[i:i + batch_size]
+        video_response = executeRequest(
+            key_pool,
+            "videos",
+            part="snippet, contentDetails, statistics", 
+            id=",".join(batch),
         )
+        
+        # Response items are not guaranteed to follow the requested order
+        items = {item["id"]: item for item in video_response["items"]}
+        
+        for videoId in batch:
+            
+            # Private or deleted videos are not returned at all
+            if videoId not in items:
+                missing_videos.append(videoId)
+                continue
+            
+            item = items[videoId]
+            metrics = item["statistics"]
+            metrics["duration"] = item["contentDetails"]["duration"]
+            metrics["definition"] = item["contentDetails"]["definition"]
+            metrics["publishedAt"] = pd.to_datetime(item["snippet"]["publishedAt"])
+            metrics["description"] = item["snippet"]["description"]
+            metrics["categoryId"] = item["snippet"]["categoryId"]
+            metrics["videoId"] = item["id"]
     
-        video_response = video_request.execute()
+            all_metrics.append(metrics)
+        
+        print(f"Metrics added for {len(all_metrics)} of {len(videoIds)} videos")
     
-        if video_response["items"]:
+    if missing_videos:
+        print(f"No metrics returned for {len(missing_videos)} videos (private or deleted): {missing_videos}")
+    
+    # Concat original dataframe with requested metrics. Save dataframe as .parquet
+    all_metrics = all_metrics.toFrame()
+    all_videos = pd.merge(left=raw_video_info, right=all_metrics, on="videoId")
+    
+    # Statistics are returned as strings (missing when hidden or comments disabled)
+    for column in ["viewCount", "likeCount", "commentCount"]:
+        all_videos[column] = pd.to_numeric(all_videos[column])
+    
+    writeTable(all_videos.set_index("videoId"), channel_path.joinpath("all_videos"))
+    
+    print(f"Generated 'all_videos.parquet' in {channel_path}")
+            
+COLUMNS_COMMENTS = ['videoId', 'comment_id', 'comment_author', 
+                    'comment_likes', 'comment_replies', 
+                    'comment_published', 'comment_update', 
+                    'comment_string', 'reply_id', 'top_level_comment']
+
+def fetchVideoComments(videoId, key_pool, requests_per_second = None, pageToken = None, order = None):
+    """ 
+    Requests comments (top level comments and replies) of a single video page by page.
+    Generator yielding each page as soon as it is received, together with the token of
+    the following page (None for the last page). Raises on any failed request.
+            
+            Parameters:
+                    videoId (str): valid YouTube videoId
+                    key_pool (KeyPool): API keys
+                    requests_per_second (float): optional request rate cap per API key
+                    pageToken (str): optional, start (resume) at this page
+                    order (str): optional, 'time' (newest first) or 'relevance' (API default)
+                    
+            Yields:
+                    video_comments (DataFrame): comments of one page
+                    nextPageToken (str): token of the following page or None
+    """
     
-            metrics = video_response["items"][0]["statistics"]
-            metrics["duration"] = video_response["items"][0]["contentDetails"]["duration"]
-            metrics["definition"] = video_response["items"][0]["contentDetails"]["definition"]
-            metrics["publishedAt"] = pd.to_datetime(video_response["items"][0]["snippet"]["publishedAt"])
-            metrics["description"] = video_response["items"][0]["snippet"]["description"]
-            metrics["categoryId"] = video_response["items"][0]["snippet"]["categoryId"]
-            metrics["videoId"] = video_response["items"][0]["id"]
+    video_comments = ColumnAccumulator(COLUMNS_COMMENTS)
     
-        _ = len(all_metrics)
-        all_metrics.loc[_] = metrics
+    # Loop breaks when no nextPageToken is generated
+    nextPageToken = pageToken
+    while True: 
+        video_comments.clear()
+        comments_response = executeRequest(
+                key_pool,
+                "commentThreads",
+                requests_per_second = requests_per_second,
+                part = 'replies, snippet', 
+                videoId = videoId,
+                maxResults = 50,
+                pageToken = nextPageToken,
+                order = order,
+                textFormat = "plainText"
+        )
+            
+        # Comments 
+        for item in comments_response["items"]:
+            
+            comments = dict()
+            comments["videoId"] = item["snippet"]["videoId"]
+            comments["comment_id"] = item["snippet"]["topLevelComment"]["id"]
+            comments["comment_author"]= item["snippet"]["topLevelComment"]["snippet"]["authorDisplayName"]
+            comments["comment_likes"] = item["snippet"]["topLevelComment"]["snippet"]["likeCount"]
+            comments["comment_replies"] = item["snippet"]["totalReplyCount"]
+            comments["comment_published"] = item["snippet"]["topLevelComment"]["snippet"]["publishedAt"]
+            comments["comment_update"] = item["snippet"]["topLevelComment"]["snippet"]["updatedAt"]
+            comments["comment_string"] = item["snippet"]["topLevelComment"]["snippet"]["textDisplay"]
+            comments["reply_id"] = "None"
+            comments["top_level_comment"] = True
+            
+            video_comments.append(comments)
+            
+            # Replies
+            if "replies" in item:
+                
+                for reply in item["replies"]["comments"]:
+                    
+                    replies = dict()
+                    replies["videoId"] = reply["snippet"]["videoId"]
+                    replies["comment_id"] = reply["snippet"]["parentId"]
+                    replies["comment_author"] = reply["snippet"]["authorDisplayName"] 
+                    replies["comment_likes"] = reply["snippet"]["likeCount"]
+                    replies["comment_replies"] = "NaN" # 
+                    replies["comment_published"] = reply["snippet"]["publishedAt"]
+                    replies["comment_update"] = reply["snippet"]["updatedAt"]
+                    replies["comment_string"] = reply["snippet"]["textDisplay"]
+                    replies["reply_id"] = reply["id"] # parentId.replyId
+                    replies["top_level_comment"] = False
+                    
+                    video_comments.append(replies)
         
-        if counter > d * 10:
-            print(f"Metrics added for over {d*10} videos")
-            d += 1
+        nextPageToken = comments_response.get('nextPageToken')    
+        yield video_comments.toFrame(), nextPageToken
         
-        counter += 1
+        if not nextPageToken:
+            break
+
+def getNewComments(videoId, key_pool, since = None, requests_per_second = None):
+    """ 
+    Requests comments of a single video published after since. Pages are requested 
+    newest first (order='time'); paging stops at the first page reaching top level 
+    comments that are already known (published at or before since).
+    NOTE: new replies to older top level comments are not found this way.
+            
+            Parameters:
+                    videoId (str): valid YouTube videoId
+                    key_pool (KeyPool): API keys
+                    since (Timestamp): publication time of the latest known comment 
+                                       (None requests all comments)
+                    requests_per_second (float): optional request rate cap per API key
+                    
+            Returns:
+                    new_comments (DataFrame): comments published after since
+    """
     
-    # Concat original dataframe with requested metrics. Save dataframe as .csv
-    all_videos = pd.merge(left=raw_video_info, right=all_metrics, on="videoId")
-    (all_videos
-     .set_index("videoId")
-     .to_csv(channel_path.joinpath("all_videos.csv"), lineterminator="\r"))
+    new_comments = []
+    pages = fetchVideoComments(videoId, key_pool, requests_per_second, order = "time")
+    
+    for video_comments, nextPageToken in pages:
+        
+        if since is None:
+            new_comments.append(video_comments)
+            continue
+        
+        published = pd.to_datetime(video_comments["comment_published"], utc = True)
+        new_comments.append(video_comments[published > since])
+        
+        if (published[video_comments["top_level_comment"]] <= since).any():
+            break
+        
+    return pd.concat(new_comments, ignore_index = True)
+
+# =============================================================================
+# Fetch checkpoints (one manifest per video stored next to its csv in tmp/)
+# =============================================================================
+
+def readCheckpoint(channel_path, videoId):
+    """ 
+    Returns the fetch state of a video, see writeCheckpoint().
+            
+            Parameters:
+                    channel_path (PosixPath): channel-specific folder path
+                    videoId (str): valid YouTube videoId
+            Returns:
+                    checkpoint (dict): keys "status", "nextPageToken", "rows", "reason"
+                                       (None if video was never fetched)
+    """
+    
+    file = channel_path.joinpath("tmp", f'{videoId}.json')
+    if not file.exists():
+        return None
+    
+    with open(file, 'r') as filepath:
+        return json.load(filepath)
+
+def writeCheckpoint(channel_path, videoId, status, nextPageToken, rows, reason = None):
+    """ 
+    Stores the fetch state of a video atomically in tmp/{videoId}.json
+            
+            Parameters:
+                    channel_path (PosixPath): channel-specific folder path
+                    videoId (str): valid YouTube videoId
+                    status (str): "partial", "failed" (both recoverable by a rerun), 
+                                  "complete" or "skipped" (permanent error, e.g. commentsDisabled)
+                    nextPageToken (str): token of the next page to be requested
+                    rows (int): number of comments already written to tmp/{videoId}.csv
+                    reason (str): optional, error reason of failed and skipped videos
+    """
+    
+    checkpoint = {"status": status, "nextPageToken": nextPageToken, "rows": rows, "reason": reason}
+    file = channel_path.joinpath("tmp", f'{videoId}.json')
+    
+    with open(file.with_suffix(".json.part"), 'w') as filepath:
+        json.dump(checkpoint, filepath)
+    os.replace(file.with_suffix(".json.part"), file)
+
+def getFetchOutcomes(videoIds, channel_path):
+    """ 
+    Returns the fetch status of each video (according to checkpoints, see writeCheckpoint()).
+            
+            Parameters:
+                    videoIds (list): list of valid YouTube videoIds
+                    channel_path (PosixPath): channel-specific folder path
+            Returns:
+                    outcomes (dict): videoId -> status ("missing" if never fetched)
+    """
     
-    print(f"Generated 'all_videos.csv' in {channel_path}")
-    youtube.close()
+    outcomes = dict()
+    for videoId in videoIds:
+        checkpoint = readCheckpoint(channel_path, videoId)
+        outcomes[videoId] = checkpoint["status"] if checkpoint else "missing"
             
-def getCommentsFromVideos(videoIds, channel_path, api_key_selector):
+    return outcomes
+
+def getMissingVideos(videoIds, channel_path):
+    """ 
+    Returns videoIds whose comments are not completely fetched but recoverable by a 
+    rerun (skipped videos with permanent errors are not included).
+            
+            Parameters:
+                    videoIds (list): list of valid YouTube videoIds
+                    channel_path (PosixPath): channel-specific folder path
+            Returns:
+                    missing_videos (list): subset of videoIds
+    """
+    
+    outcomes = getFetchOutcomes(videoIds, channel_path)
+    return [videoId for videoId in videoIds if outcomes[videoId] not in ("complete", "skipped")]
+
+def getCompleteVideos(videoIds, channel_path):
+    """Returns videoIds whose comments are completely fetched (see getMissingVideos())."""
+    
+    outcomes = getFetchOutcomes(videoIds, channel_path)
+    return [videoId for videoId in videoIds if outcomes[videoId] == "complete"]
+
+def getCommentsFromVideos(videoIds, channel_path, api_key_selector, 
+                          max_workers = 1, requests_per_second = None, sink = None):
     """ 
     Requests YouTube video comments from videoId list. Comments stored in csv for each video.
-    Executes n API requests (n = number of videoIds). If fetch incomplete, "missing_videos.json" is stored
-    locally.
+    Each page is appended to tmp/{videoId}.csv right away and checkpointed in tmp/{videoId}.json 
+    (see writeCheckpoint()). Reruns skip complete videos and resume incomplete ones at 
+    the last stored nextPageToken. With max_workers > 1, several videos are fetched in 
+    parallel (one YouTube instance per worker thread). If the quota of an API key is 
+    exceeded, the fetch continues with the next key of the KeyPool. With a sink 
+    (e.g. ParquetCommentSink), each completed video is handed over to the sink and 
+    its csv in tmp/ is removed.
+    Failed requests are classified (see executeRequest()): videos with permanent errors 
+    (e.g. commentsDisabled) are checkpointed as "skipped" and not requested again, 
+    videos with transient errors stay recoverable. If the quota of all keys is exhausted, 
+    no further requests are sent and QuotaExhaustedError is raised once all workers stopped.
             
             Parameters:
                     videoId_list (list): list of valid YouTube videoIds
                     channel_path (PosixPath): channel-specific folder path
-                    api_key_selector (str): choose between 'first_key' or 'second_key'
+                    api_key_selector (str or KeyPool): API key or KeyPool
+                    max_workers (int): number of videos fetched concurrently
+                    requests_per_second (float): optional request rate cap per API key 
+                                                 (shared by all workers)
+                    sink (ParquetCommentSink): optional, receives each completed video
                     
             Returns:
-                    No returns. If comment fetch incomplete "missing_videos.json" is stored locally
+                    missing_videos (list): videoIds that are still incomplete but recoverable
     
     """
     
     print('Getting channel comments ... ')
     
-    # Instantiate youtube instance with given api_key_selector
-    youtube = setupYouTube(api_key_selector)
+    channel_path.joinpath("tmp").mkdir(exist_ok=True)
+    key_pool = asKeyPool(api_key_selector)
     
-    # Loop through videos
-    for videoId in videoIds:
+    # Progress counter and quota stop signal shared by worker threads
+    progress_lock = threading.Lock()
+    n_done = [0]
+    quota_exhausted = threading.Event()
+    
+    def fetchAndStore(videoId):
         
-        columns_comments = ['videoId', 'comment_id', 'comment_author', 
-                            'comment_likes', 'comment_replies', 
-                            'comment_published', 'comment_update', 
-                            'comment_string', 'reply_id', 'top_level_comment']
+        file = channel_path.joinpath("tmp", f'{videoId}.csv')
+        checkpoint = readCheckpoint(channel_path, videoId)
         
-        video_comments = pd.DataFrame(columns = columns_comments)
+        if checkpoint and checkpoint["status"] in ("complete", "skipped"):
+            return
+        if quota_exhausted.is_set():
+            return
+        
+        # Resume incomplete video. Rows written after the last checkpoint are dropped
+        if checkpoint and checkpoint["rows"]:
+            rows, pageToken = checkpoint["rows"], checkpoint["nextPageToken"]
+            stored = pd.read_csv(file, index_col = 0, dtype = COMMENT_DTYPES)
+            if len(stored) > rows:
+                stored.iloc[:rows].to_csv(file, escapechar='|')
+        else:
+            rows, pageToken = 0, None
+            if file.exists():
+                os.remove(file)
         
-        # Try/except part allows only to store a complete comment request per video
-        nextPageToken = None
         try:
-            # Loop breaks when no nextPageToken is generated
-            while True: 
-                comments_request = youtube.commentThreads().list(
-                        part = 'replies, snippet', 
-                        videoId = videoId,
-                        maxResults = 50,
-                        pageToken = nextPageToken,
-                        textFormat = "plainText"
-                )
+            pages = fetchVideoComments(videoId, key_pool, requests_per_second, pageToken)
+            
+            for video_comments, nextPageToken in pages:
                 
-                comments_response = comments_request.execute()
-                    
-                # Comments 
-                for item in comments_response["items"]:
-                    
-                    comments = dict()
-                    comments["videoId"] = item["snippet"]["videoId"]
-                    comments["comment_id"] = item["snippet"]["topLevelComment"]["id"]
-                    comments["comment_author"]= item["snippet"]["topLevelComment"]["snippet"]["authorDisplayName"]
-                    comments["comment_likes"] = item["snippet"]["topLevelComment"]["snippet"]["likeCount"]
-                    comments["comment_replies"] = item["snippet"]["totalReplyCount"]
-                    comments["comment_published"] = item["snippet"]["topLevelComment"]["snippet"]["publishedAt"]
-                    comments["comment_update"] = item["snippet"]["topLevelComment"]["snippet"]["updatedAt"]
-                    comments["comment_string"] = item["snippet"]["topLevelComment"]["snippet"]["textDisplay"]
-                    comments["reply_id"] = "None"
-                    comments["top_level_comment"] = True
-                    
-                    _ = len(video_comments)
-                    video_comments.loc[_] = comments
-                    
-                    # Replies
-                    if "replies" in item:
-                        
-                        for reply in item["replies"]["comments"]:
-                            
-                            replies = dict()
-                            replies["videoId"] = reply["snippet"]["videoId"]
-                            replies["comment_id"] = reply["snippet"]["parentId"]
-                            replies["comment_author"] = reply["snippet"]["authorDisplayName"] 
-                            replies["comment_likes"] = reply["snippet"]["likeCount"]
-                            replies["comment_replies"] = "NaN" # 
-                            replies["comment_published"] = reply["snippet"]["publishedAt"]
-                            replies["comment_update"] = reply["snippet"]["updatedAt"]
-                            replies["comment_string"] = reply["snippet"]["textDisplay"]
-                            replies["reply_id"] = reply["id"] # parentId.replyId
-                            replies["top_level_comment"] = False
-                            
-                            _ = len(video_comments)
-                            video_comments.loc[_] = replies
+                # Append page locally in temporary folder, then checkpoint it
+                video_comments.index += rows
+                video_comments.to_csv(file, mode = 'a', header = not file.exists(), escapechar='|')
+                rows += len(video_comments)
                 
-                nextPageToken = comments_response.get('nextPageToken')    
-                if not nextPageToken:
-                    break
+                # Complete video goes to sink before it is checkpointed as complete
+                if sink and not nextPageToken:
+                    sink.write(videoId, pd.read_csv(file, index_col = 0, dtype = COMMENT_DTYPES))
                 
-            # Save populated dataframe locally in temporary folder 
-            channel_path.joinpath("tmp").mkdir(exist_ok=True)
-            video_comments.to_csv(channel_path.joinpath("tmp", f'{videoId}.csv'), escapechar='|')  
+                status = "partial" if nextPageToken else "complete"
+                writeCheckpoint(channel_path, videoId, status, nextPageToken, rows)
+                pageToken = nextPageToken
+            
+            if sink:
+                os.remove(file)
             
-            progress = f'Video {videoIds.index(videoId)+1} of {len(videoIds)}'
-            print(f'{progress} {videoId} | {len(video_comments)} comments found')
+            with progress_lock:
+                n_done[0] += 1
+                progress = f'Video {n_done[0]} of {len(videoIds)}'
+            print(f'{progress} {videoId} | {rows} comments found')
         
-        # If requests fails, give only info via print
-        except:
-            print(f'Comment requests incomplete for {videoId}')
+        # Stop signal for all workers (fetched pages are kept)
+        except QuotaExhaustedError:
+            quota_exhausted.set()
+            print(f'Comment requests incomplete for {videoId} ({rows} comments checkpointed, quota exhausted)')
         
-    # Detect missing videos and save them locally in json
-    _ = os.listdir(channel_path.joinpath("tmp"))
-    fetched_videoIds = [os.path.splitext(x)[0] for x in _]
-    missing_videos = list(set(videoIds).difference(set(fetched_videoIds)))
+        # Permanent errors of the video: video is skipped in reruns
+        except HttpError as error:
+            reason = getErrorReason(error) or str(error.resp.status)
+            if classifyError(error) == "permanent":
+                writeCheckpoint(channel_path, videoId, "skipped", None, rows, reason)
+                print(f'Comments of {videoId} skipped ({reason})')
+            else:
+                writeCheckpoint(channel_path, videoId, "failed", pageToken, rows, reason)
+                print(f'Comment requests incomplete for {videoId} ({rows} comments checkpointed, {reason})')
+        
+        # Other failures (e.g. retries of connection errors exhausted) stay recoverable
+        except Exception as error:
+            print(f'Comment requests incomplete for {videoId} ({rows} comments checkpointed, {type(error).__name__})')
     
+    # Loop through videos
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        list(executor.map(fetchAndStore, videoIds))
+        
+    # Detect missing (recoverable) and skipped videos from checkpoints
+    outcomes = getFetchOutcomes(videoIds, channel_path)
+    missing_videos = getMissingVideos(videoIds, channel_path)
+    skipped_videos = [videoId for videoId in videoIds if outcomes[videoId] == "skipped"]
+    
+    if skipped_videos:
+        print(f'{len(skipped_videos)} videos skipped (e.g. comments disabled or video deleted).')
+    if quota_exhausted.is_set():
+        print(f'Comments fetch NOT complete. {len(missing_videos)} are missing, quota of all API keys exhausted.')
+        raise QuotaExhaustedError(f'{len(missing_videos)} videos missing')
     if missing_videos:
         print(f'Comments fetch NOT complete. {len(missing_videos)} are missing.')
-        with open(channel_path.joinpath("missing_videos.json"), 'w') as filepath:
-            json.dump(missing_videos, filepath)
-        
-    # If fetch complete, remove missing_videos.json
     else:
+        print('Comments of all videos fetched :)')
+        print()
         
-        if "missing_videos.json" in os.listdir(channel_path):
-            file = channel_path.joinpath("missing_videos.json")
-            os.remove(file)
-            print('Rerun succesfull. Comments of all videos fetched :)')
-        else:
-            print('Comments of all videos fetched :)')
-            print()
+    return missing_videos
 
 
 
 
 # =============================================================================
-# Outsourced functions - No API requests involved below
-# Mainly concatenations and data restructuring
+# Parquet dataset of comments (data/comments_dataset/channel=.../videoId=...)
 # =============================================================================
 
+COMMENT_SCHEMA = pa.schema([
+    ("comment_id", pa.string()),
+    ("comment_author", pa.string()),
+    ("comment_likes", pa.int64()),
+    ("comment_replies", pa.float64()),
+    ("comment_published", pa.timestamp("ns", tz = "UTC")),
+    ("comment_string", pa.string()),
+    ("reply_id", pa.string()),
+    ("top_level_comment", pa.bool_()),
+    ("Title", pa.string()),
+    ("videoOwnerChannelTitle", pa.string()),
+    ("publishedAt", pa.timestamp("ns", tz = "UTC")),
+])
 
-def concatCommentsAndVideos(channel_paths):
+class ParquetCommentSink:
+    
+    """
+    Writes the comments of each completed video as one Parquet file into the channel 
+    partition of the comments dataset. Video features are joined while writing, 
+    thus consolidate() only needs to collect file metadata (no rewrite of comments).
+    Partition columns (channel, videoId) are stored in the folder names only.
+    
+            Parameters:
+                    channel_foldername (str): name of the channel partition
+                    video_features (DataFrame): "Title", "videoOwnerChannelTitle", "publishedAt"
+                                                indexed by videoId (e.g. from all_videos)
+                    dataset_path (PosixPath): root folder of the dataset
+    """
     
+    def __init__(self, channel_foldername, video_features, dataset_path = dataset_path):
+        self.channel_path = dataset_path.joinpath(f'channel={channel_foldername}')
+        self.channel_path.mkdir(parents = True, exist_ok = True)
+        self.video_features = video_features
+        
+    def file(self, videoId):
+        return self.channel_path.joinpath(f'videoId={videoId}', "part-0.parquet")
+        
+    def write(self, videoId, video_comments):
+        
+        # Augment video features (same as fetch.py did after concatenation)
+        for column in ["Title", "videoOwnerChannelTitle", "publishedAt"]:
+            video_comments[column] = self.video_features.loc[videoId, column]
+        
+        # Fixed dtypes (pages read back from csv may infer them differently)
+        video_comments["comment_likes"] = pd.to_numeric(video_comments["comment_likes"]).astype("int64")
+        video_comments["comment_replies"] = pd.to_numeric(video_comments["comment_replies"], errors = "coerce")
+        video_comments["comment_published"] = pd.to_datetime(video_comments["comment_published"], utc = True)
+        video_comments["publishedAt"] = pd.to_datetime(video_comments["publishedAt"], utc = True)
+        for column in ["comment_id", "comment_author", "comment_string", "reply_id", 
+                       "Title", "videoOwnerChannelTitle"]:
+            video_comments[column] = video_comments[column].astype("string")
+        
+        table = pa.Table.from_pandas(video_comments[COMMENT_SCHEMA.names], 
+                                     schema = COMMENT_SCHEMA, preserve_index = False)
+        
+        file = self.file(videoId)
+        file.parent.mkdir(exist_ok = True)
+        pq.write_table(table, file.with_suffix(".parquet.part"))
+        os.replace(file.with_suffix(".parquet.part"), file)
+        
+    def consolidate(self, videoIds):
+        """
+        Writes _metadata of the channel partition (footers of all video files). 
+        Returns number of comments.
+        """
+        
+        metadata = None
+        for videoId in videoIds:
+            file_metadata = pq.read_metadata(self.file(videoId))
+            file_metadata.set_file_path(f'videoId={videoId}/part-0.parquet')
+            if metadata is None:
+                metadata = file_metadata
+            else:
+                metadata.append_row_groups(file_metadata)
+        
+        pq.write_metadata(COMMENT_SCHEMA, self.channel_path.joinpath("_metadata"), 
+                          metadata_collector = [metadata] if metadata else None)
+        return metadata.num_rows if metadata else 0
+
+def readCommentDataset(channel_foldername, columns = None, dataset_path = dataset_path):
     """ 
-    Turns various csv files back into DataFrames.
-    Requires two csv's "all_comments_withSentiment.csv" and "all_videos.csv" 
-    in each subfolder listed in channel_paths.
+    Reads the comments of a channel from the Parquet dataset (see ParquetCommentSink).
+    Uses the consolidated _metadata if available, otherwise discovers all files.
     
     Parameters:
-            channel_paths (list): list of PosixPath's
+            channel_foldername (str): name of the channel partition
+            columns (list): optional, columns to read
+            dataset_path (PosixPath): root folder of the dataset
             
     Returns:
-            comments (DataFrame): concatenated comments found within channel_paths
-            videos (DataFrame): concatenaed videos found within channel_paths
+            comments (DataFrame): comments incl. videoId
     """
     
-    comments = pd.DataFrame()
-    videos = pd.DataFrame()
+    return commentDataset(channel_foldername, dataset_path).to_table(columns = columns).to_pandas()
+
+def commentDataset(channel_foldername, dataset_path = dataset_path):
+    """ pyarrow Dataset of the comments of a channel (see readCommentDataset()) """
     
-    for channel_path in channel_paths:
-        try:
-            # Import all_comments...
-            comments_per_channel = pd.read_csv(channel_path.joinpath("all_comments_withSentiment.csv"), 
-                                               index_col = 0, lineterminator="\r",
-                                               parse_dates = ["publishedAt", "comment_published"] )
-            
-            comments = pd.concat([comments, comments_per_channel], axis = 0)
-        
-            # Import all_videos 
-            videos_per_channel = pd.read_csv(channel_path.joinpath("all_videos.csv"), 
-                                             index_col = 0, lineterminator="\r",
-                                             parse_dates = ["publishedAt"])
-            
-            videos = pd.concat([videos, videos_per_channel], axis = 0)
+    channel_path = dataset_path.joinpath(f'channel={channel_foldername}')
+    partitioning = ds.partitioning(pa.schema([("videoId", pa.string())]), flavor = "hive")
+    
+    if channel_path.joinpath("_metadata").exists():
+        return ds.parquet_dataset(channel_path.joinpath("_metadata"), partitioning = partitioning)
+    return ds.dataset(channel_path, format = "parquet", partitioning = partitioning)
+
+# =============================================================================
+# Table storage (Parquet with embedded schema, csv export optional)
+# Tables are addressed without suffix, e.g. channel_path.joinpath("all_videos").
+# Legacy csv files (+ dtype json, see writeTable(csv=True)) are still read as fallback.
+# A folder of tables (e.g. processed/comments/{channel}) is read as one table,
+# appendTable() adds rows as a new part file of such a folder.
+# =============================================================================
+
+def tableFiles(path):
+    """ Returns parquet, csv and dtype json file of a table path (suffix is ignored) """
+    path = Path(path)
+    if path.suffix in (".parquet", ".csv", ".json"):
+        path = path.with_suffix("")
+    return [path.with_name(path.name + suffix) for suffix in (".parquet", ".csv", ".json")]
+
+def tableExists(path):
+    parquet_file, csv_file, _ = tableFiles(path)
+    return parquet_file.exists() or csv_file.exists() or Path(path).is_dir()
+
+def removeTable(path):
+    for file in tableFiles(path):
+        file.unlink(missing_ok = True)
+    if Path(path).is_dir():
+        shutil.rmtree(path)
+
+def writeTable(df, path, csv = False):
+    """
+    Writes DataFrame as Parquet file. The schema (incl. index, timezone-aware timestamps
+    and categoricals) is embedded in the file, no dtype json required.
+
+    Parameters:
+            df (DataFrame): table to write
+            path (PosixPath): table path without suffix
+            csv (bool): additionally export csv ('\\r' terminated) and dtype json
+    """
+
+    parquet_file, csv_file, json_file = tableFiles(path)
+
+    # Written to .part first, readers never see half written files
+    part_file = parquet_file.with_name(parquet_file.name + ".part")
+    df.to_parquet(part_file, engine = "pyarrow")
+    os.replace(part_file, parquet_file)
+
+    if csv:
+        df.to_csv(csv_file, lineterminator="\r")
+        with open(json_file, 'w') as f:
+            json.dump(df.dtypes.astype(str).to_dict(), f)
+
+def tableParts(path):
+    """ Part files of a table folder (see appendTable()) """
+    return sorted(Path(path).glob("*.parquet")) if Path(path).is_dir() else []
+
+def appendTable(df, path):
+    """
+    Appends rows to a table without rewriting it: df is written as a new part file
+    of the folder path (part-NNNNN.parquet). A table stored as single file is moved
+    into the folder as first part.
+
+    Parameters:
+            df (DataFrame): rows to append
+            path (PosixPath): table path without suffix
+    """
+
+    parquet_file = tableFiles(path)[0]
+    Path(path).mkdir(exist_ok = True)
+    if parquet_file.exists():
+        os.replace(parquet_file, Path(path).joinpath("part-00000.parquet"))
+
+    writeTable(df, Path(path).joinpath(f'part-{len(tableParts(path)):05d}'))
+
+def readTable(path, columns = None, filters = None, **csv_kwargs):
+    """
+    Reads table written by writeTable(). Only requested columns and row groups matching
+    filters are read from Parquet files (column and predicate pushdown). For a folder,
+    all Parquet tables within are read and concatenated (rows numbered anew if the
+    tables have a RangeIndex).
+
+    Parameters:
+            path (PosixPath): table path without suffix
+            columns (list): optional, columns to read (index is always included)
+            filters (list): optional, pyarrow filters e.g. [("videoId", "in", videoIds)]
+            **csv_kwargs: passed to pd.read_csv for legacy csv files (e.g. dtype, parse_dates)
+
+    Returns:
+            df (DataFrame): table
+    """
+
+    parquet_file, csv_file, json_file = tableFiles(path)
+
+    if Path(path).is_dir():
+        frames = [readTable(file, columns = columns, filters = filters) for file in tableParts(path)]
+        if not frames:
+            return pd.DataFrame(columns = columns)
+        df = concatFrames(frames)
+        if all(isinstance(frame.index, pd.RangeIndex) for frame in frames):
+            df = df.reset_index(drop = True)
+        return df
+
+    if parquet_file.exists():
+        return pd.read_parquet(parquet_file, engine = "pyarrow", columns = columns, filters = filters)
+
+    # Legacy csv, dtypes from json (if exported together with the csv)
+    df = pd.read_csv(csv_file, index_col = 0, lineterminator="\r", **csv_kwargs)
+    if json_file.exists():
+        with open(json_file, 'r') as f:
+            df = df.astype(json.load(f))
+
+    if filters:
+        table = ds.dataset(pa.Table.from_pandas(df)).to_table(filter = pq.filters_to_expression(filters))
+        df = table.to_pandas()
+
+    return df[columns] if columns is not None else df
+
+def iterTable(path, columns = None, chunk_size = 100000, **csv_kwargs):
+    """
+    Reads table written by writeTable() in chunks of at most chunk_size rows 
+    (memory bounded by the chunk size, not the table size). See readTable().
+    """
+
+    parquet_file, csv_file, _ = tableFiles(path)
+
+    if Path(path).is_dir():
+        for file in tableParts(path):
+            yield from iterTable(file, columns = columns, chunk_size = chunk_size)
+        return
+
+    if parquet_file.exists():
+        for batch in pq.ParquetFile(parquet_file).iter_batches(batch_size = chunk_size, columns = columns):
+            yield batch.to_pandas()
+        return
+
+    # Legacy csv
+    for chunk in pd.read_csv(csv_file, index_col = 0, lineterminator="\r", chunksize = chunk_size, **csv_kwargs):
+        yield chunk[columns] if columns is not None else chunk
+
+# =============================================================================
+# Comments of a channel and sidecar store of sentiment scores
+# Comments are stored without sentiment (all_comments), scores are kept separately
+# in sentiment_scores/part-*.parquet keyed by (comment_id, reply_id).
+# =============================================================================
+
+SCORE_KEYS = ["comment_id", "reply_id"]
+SCORE_COLUMNS = ["prediction", "positive", "negative", "neutral"]
+
+# Comment tables of a channel folder (all_comments, older layouts as well)
+COMMENT_TABLES = ["all_comments", "all_comments_withSentiment", "all_comments_noSentiment"]
+
+def channelHasComments(channel_path):
+    in_dataset = dataset_path.joinpath(f'channel={channel_path.name}', "_metadata").exists()
+    return in_dataset or any(tableExists(channel_path.joinpath(table)) for table in COMMENT_TABLES)
+
+def readChannelComments(channel_path, columns = None):
+    """ 
+    Reads all comments of a channel (comment tables and the Parquet dataset) without 
+    sentiment columns. Comments found more than once are kept once.
+    
+    Parameters:
+            channel_path (PosixPath): channel folder (data/interim/@channel)
+            columns (list): optional, columns to read
             
-            print(f'comments and videos concatenated from {channel_path}')
+    Returns:
+            comments (DataFrame): comments of the channel
+    """
+    
+    frames = []
+    for table in COMMENT_TABLES:
+        if tableExists(channel_path.joinpath(table)):
+            frames.append(readTable(channel_path.joinpath(table), columns = columns, dtype = COMMENT_DTYPES,
+                                   parse_dates = ["publishedAt", "comment_published"]))
+    
+    if dataset_path.joinpath(f'channel={channel_path.name}', "_metadata").exists():
+        frames.append(readCommentDataset(channel_path.name, columns = columns))
+    
+    if not frames:
+        return pd.DataFrame(columns = columns)
+    
+    comments = pd.concat(frames, ignore_index = True)
+    comments = comments.drop(columns = [column for column in SCORE_COLUMNS if column in comments])
+    if set(SCORE_KEYS).issubset(comments.columns) and len(frames) > 1:
+        comments = comments[~scoreKeyIndex(comments).duplicated(keep = "last")]
+    return comments.reset_index(drop = True)
+
+def iterChannelComments(channel_path, columns = None, chunk_size = 100000):
+    """ 
+    Reads the comments of a channel (same sources as readChannelComments()) in chunks 
+    of about chunk_size rows. Comments are not deduplicated across sources.
+    
+    Parameters:
+            channel_path (PosixPath): channel folder (data/interim/@channel)
+            columns (list): optional, columns to read
+            chunk_size (int): rows per chunk
             
-        except FileNotFoundError:
-            print("Required csv files not found in ... ")
-            print(f"{channel_path}")
+    Yields:
+            comments (DataFrame): chunk of comments
+    """
+    
+    def frames():
+        for table in COMMENT_TABLES:
+            if tableExists(channel_path.joinpath(table)):
+                yield from iterTable(channel_path.joinpath(table), columns = columns, chunk_size = chunk_size, 
+                                     dtype = COMMENT_DTYPES, parse_dates = ["publishedAt", "comment_published"])
         
-    return comments, videos
+        if dataset_path.joinpath(f'channel={channel_path.name}', "_metadata").exists():
+            for batch in commentDataset(channel_path.name).to_batches(columns = columns, batch_size = chunk_size):
+                yield batch.to_pandas()
     
+    # Small frames (e.g. one per video file of the dataset) are collected to chunks
+    buffer = []
+    for frame in frames():
+        buffer.append(frame.drop(columns = [column for column in SCORE_COLUMNS if column in frame]))
+        if sum(len(frame) for frame in buffer) >= chunk_size:
+            yield pd.concat(buffer, ignore_index = True)
+            buffer = []
+    
+    if buffer and sum(len(frame) for frame in buffer):
+        yield pd.concat(buffer, ignore_index = True)
+
+def scoreKeyIndex(df):
+    """ (comment_id, reply_id) as MultiIndex, top level comments have reply_id "None" """
+    
+    reply_id = df["reply_id"].astype(object)
+    reply_id = reply_id.where(reply_id.notna(), "None").astype(str)
+    return pd.MultiIndex.from_arrays([df["comment_id"].astype(str), reply_id], names = SCORE_KEYS)
+
+class SentimentScoreStore:
+    
+    """
+    Sentiment scores of a channel, stored next to the comments in sentiment_scores/.
+    New scores are appended as additional part files (existing scores are never 
+    rewritten). Each part is written atomically, thus completed parts mark the progress
+    of an interrupted run. Scores of an older all_comments_withSentiment table are 
+    imported once.
+    
+            Parameters:
+                    channel_path (PosixPath): channel folder (data/interim/@channel)
+    """
+    
+    def __init__(self, channel_path):
+        self.channel_path = channel_path
+        self.path = channel_path.joinpath("sentiment_scores")
+        
+    def parts(self):
+        return tableParts(self.path)
+    
+    def append(self, scores):
+        """ Stores scores (DataFrame with SCORE_KEYS and SCORE_COLUMNS) as new part file """
+        
+        if scores.empty:
+            return
+        
+        scores = scores[SCORE_KEYS + SCORE_COLUMNS].reset_index(drop = True)
+        keys = scoreKeyIndex(scores)
+        scores["comment_id"] = keys.get_level_values("comment_id")
+        scores["reply_id"] = keys.get_level_values("reply_id")
+        
+        appendTable(scores, self.path)
+        
+    def read(self, columns = None, filters = None):
+        """ 
+        Returns scores (filters: optional, pyarrow filters pushed down to the part files),
+        for keys scored more than once the latest scores
+        """
+        
+        legacy = self.channel_path.joinpath("all_comments_withSentiment")
+        if not self.parts() and tableExists(legacy):
+            self.append(readTable(legacy, columns = SCORE_KEYS + SCORE_COLUMNS, dtype = COMMENT_DTYPES))
+        
+        if not self.parts():
+            return pd.DataFrame(columns = SCORE_KEYS + SCORE_COLUMNS)
+        
+        scores = pd.concat([pd.read_parquet(part, columns = columns, filters = filters) for part in self.parts()], 
+                           ignore_index = True)
+        if set(SCORE_KEYS).issubset(scores.columns):
+            scores = scores[~scoreKeyIndex(scores).duplicated(keep = "last")]
+        return scores.reset_index(drop = True)
+    
+    def keys(self, comment_ids = None):
+        """ (comment_id, reply_id) of scored comments (comment_ids: optional, only these are read) """
+        
+        filters = None if comment_ids is None else [("comment_id", "in", pd.unique(comment_ids).astype(str).tolist())]
+        return scoreKeyIndex(self.read(columns = SCORE_KEYS, filters = filters))
+    
+    def missing(self, comments):
+        """ 
+        Boolean mask of comments without scores. Only scores of the comment_ids of comments
+        are read (filter pushed down to the part files), memory is bounded by the size of 
+        comments, not of the store.
+        """
+        
+        scored = self.keys(comments["comment_id"])
+        return pd.Series(~scoreKeyIndex(comments).isin(scored), index = comments.index)
+    
+    def join(self, comments, how = "inner"):
+        """ Adds SCORE_COLUMNS to comments (inner: comments without scores are dropped) """
+        
+        scores = self.read().set_index(SCORE_KEYS)
+        keys = scoreKeyIndex(comments)
+        positions = scores.index.get_indexer(keys)
+        
+        scored = positions >= 0
+        if how == "inner":
+            comments, positions = comments[scored], positions[scored]
+            if (~scored).any():
+                print(f'{self.channel_path.name} | {(~scored).sum()} comments without sentiment scores skipped')
+        
+        comments = comments.copy()
+        for column in SCORE_COLUMNS:
+            values = scores[column].to_numpy()[positions]
+            comments[column] = pd.Series(values, index = comments.index).where(positions >= 0)
+        return comments
+
+def readScoredComments(channel_path, compact = False):
+    """ readChannelComments() joined with scores of SentimentScoreStore, used by loadFiles() """
+    
+    comments = SentimentScoreStore(channel_path).join(readChannelComments(channel_path))
+    return compactComments(comments) if compact else comments
 
 # =============================================================================
-# Export and import of datatypes
+# Outsourced functions - No API requests involved below
+# Mainly concatenations and data restructuring
 # =============================================================================
 
-def exportDFdtypes(df, jsonfile):
+
+# Fixed dtypes of comment csv files (tmp/{videoId}.csv and all_comments_*.csv)
+COMMENT_DTYPES = {"videoId": str,
+                  "comment_id": str,
+                  "comment_author": str,
+                  "comment_likes": "int64",
+                  "comment_replies": "float64",
+                  "comment_string": str,
+                  "reply_id": str,
+                  "top_level_comment": bool,
+                  "Title": str,
+                  "videoOwnerChannelTitle": str,
+                  "prediction": str,
+                  "positive": "float64",
+                  "negative": "float64",
+                  "neutral": "float64"}
+
+# =============================================================================
+# Memory-compact comment frames
+# Repeated strings as categoricals, free text as Arrow strings, float32 scores,
+# nullable ints and missing reply_id (instead of the "None" sentinel)
+# =============================================================================
+
+COMPACT_CATEGORIES = ["videoId", "comment_author", "videoOwnerChannelTitle", "Title", "prediction"]
+COMPACT_STRINGS = ["comment_id", "comment_string", "reply_id"]
+COMPACT_FLOATS = ["positive", "negative", "neutral", "prediction_num"]
+COMPACT_INTS = {"comment_likes": "Int32",
+                "comment_replies": "Int32",
+                "comment_word_count": "Int32",
+                "comments_published_year": "Int16"}
+
+def compactComments(comments):
     """ 
-    Exports data types from given data frame into json file
-    See also importDFdtypes().
+    Converts comment columns into memory-compact dtypes (columns not present are 
+    ignored, already compact columns are kept). Top level comments get a missing 
+    reply_id, top_level_comment remains the boolean reply flag.
+    NOTE: group by categorical columns with observed=True (otherwise all categories 
+    are returned, including empty groups).
     
     Parameters:
-            df (DataFrame): name of DataFrame
-            jsonfile (str): Name of json file
+            comments (DataFrame): comments (e.g. all_comments_withSentiment)
+            
+    Returns:
+            comments (DataFrame): same comments, compact dtypes
+    """
+    
+    columns = set(comments.columns)
+    
+    for column in columns.intersection(COMPACT_CATEGORIES):
+        comments[column] = comments[column].astype("category")
+    
+    for column in columns.intersection(COMPACT_STRINGS):
+        comments[column] = comments[column].astype("string[pyarrow]")
+    
+    if "reply_id" in columns:
+        comments["reply_id"] = comments["reply_id"].mask(comments["reply_id"] == "None")
+        if "top_level_comment" not in columns:
+            comments["top_level_comment"] = comments["reply_id"].isna()
+    
+    for column in columns.intersection(["top_level_comment", "owner_comment"]):
+        comments[column] = comments[column].astype(bool)
+    
+    for column in columns.intersection(COMPACT_FLOATS):
+        comments[column] = comments[column].astype("float32")
+        
+    for column, dtype in COMPACT_INTS.items():
+        if column in columns:
+            comments[column] = comments[column].astype(dtype)
+    
+    return comments
+
+def concatFrames(frames):
+    """ 
+    pd.concat of frames keeping categorical columns (categories are unified first,
+    otherwise pandas falls back to object columns).
+    """
+    
+    frames = list(frames)
+    for column in frames[0].columns:
+        if all(column in frame and isinstance(frame[column].dtype, pd.CategoricalDtype) 
+               for frame in frames):
+            categories = frames[0][column].cat.categories
+            for frame in frames[1:]:
+                categories = categories.union(frame[column].cat.categories)
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    
+    return pd.concat(frames, axis = 0)
+
+def reportMemory(df, name = "DataFrame"):
+    """ Prints and returns memory usage per row (incl. strings, index) """
+    
+    total = df.memory_usage(deep = True).sum()
+    per_row = total / max(len(df), 1)
+    print(f'{name} | {len(df)} rows | {round(total / 1e6, 1)} MB | {round(per_row)} bytes per row')
+    return per_row
+
+def loadFiles(files, max_workers = 8, use_processes = False, read_func = pd.read_csv, **read_kwargs):
+    
+    """ 
+    Reads many files in parallel and concatenates them once (instead of growing 
+    a DataFrame file by file). Reports progress and number of rows read.
+    
+    Parameters:
+            files (list): list of PosixPath's
+            max_workers (int): number of parallel readers
+            use_processes (bool): processes instead of threads (for many small files, 
+                                  the csv parser holds the GIL for parts of the work)
+            read_func (function): reader per file, pd.read_csv or readTable
+            **read_kwargs: passed to read_func (e.g. dtype, parse_dates, lineterminator)
+            
+    Returns:
+            df (DataFrame): concatenated files
     """
     
-    df_dtypes = df.dtypes.astype(str).to_dict()
+    files = list(files)
+    if not files:
+        return pd.DataFrame()
     
-    with open(processed_path.joinpath(jsonfile), 'w') as f:
-        json.dump(df_dtypes, f)
+    Executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    frames = []
+    
+    with Executor(max_workers = max_workers) as executor:
+        futures = [executor.submit(read_func, file, **read_kwargs) for file in files]
         
-def importDFdtypes(jsonfile):
+        # Results are collected in file order, progress reported in 10% steps
+        for i, future in enumerate(futures):
+            frames.append(future.result())
+            if (i + 1) % max(1, len(files) // 10) == 0 or i + 1 == len(files):
+                print(f'Files loaded: {i+1} of {len(files)}')
+    
+    df = concatFrames(frames)
+    print(f'{len(df)} rows read from {len(files)} files')
+    return df
+
+def concatCommentsAndVideos(channel_paths, compact = False):
+    
     """ 
-    ImoportExports data types from given data frame into json file
-    See also exportDFdtypes().
+    Turns the per-channel tables back into DataFrames.
+    Requires comments (see readChannelComments()) and "all_videos" (Parquet or legacy csv)
+    in each subfolder listed in channel_paths. Sentiment scores are joined from the
+    score store of each channel (comments without scores are skipped).
+    Files are read in parallel (see loadFiles()).
     
     Parameters:
-            jsonfile (str): Name of json file
-    Return:
-            dict() with datatypes 
+            channel_paths (list): list of PosixPath's
+            compact (bool): comments with memory-compact dtypes, converted per channel 
+                            while loading (see compactComments())
+            
+    Returns:
+            comments (DataFrame): concatenated comments found within channel_paths
+            videos (DataFrame): concatenaed videos found within channel_paths
+    """
+    
+    complete_paths = []
+    for channel_path in channel_paths:
+        if channelHasComments(channel_path) and tableExists(channel_path.joinpath("all_videos")):
+            complete_paths.append(channel_path)
+        else:
+            print("Required tables not found in ... ")
+            print(f"{channel_path}")
+    
+    # Import comments incl. sentiment scores
+    comments = loadFiles(complete_paths, read_func = readScoredComments, compact = compact)
+    reportMemory(comments, "comments")
+    
+    # Import all_videos (csv arguments only apply to legacy csv files)
+    videos = loadFiles([channel_path.joinpath("all_videos") for channel_path in complete_paths],
+                       read_func = readTable, parse_dates = ["publishedAt"])
+    
+    print(f'comments and videos concatenated from {len(complete_paths)} channels')
         
+    return comments, videos
+
+
+# =============================================================================
+# Fingerprints of input files and manifest (incremental processing)
+# A channel is processed again only if the fingerprint of its inputs changed.
+# =============================================================================
+
+def fileFingerprint(files, content = False):
+    """ 
+    Hash of name, size and modification time (or content) of files (missing files 
+    are ignored).
+    
+    Parameters:
+            files (list): list of PosixPath's
+            content (bool): hash file contents instead of size and modification time
+    Returns:
+            fingerprint (str): sha256 hex digest
     """
     
-    with open(processed_path.joinpath(jsonfile), 'r') as f:
+    digest = hashlib.sha256()
+    for file in sorted(Path(file) for file in files):
+        if not file.is_file():
+            continue
+        digest.update(f'{file.parent.name}/{file.name}'.encode())
+        if content:
+            digest.update(file.read_bytes())
+        else:
+            stat = file.stat()
+            digest.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    
+    return digest.hexdigest()
+
+def channelInputFiles(channel_path):
+    """ Files read by concatCommentsAndVideos() for a channel """
+    
+    files = []
+    for table in COMMENT_TABLES + ["all_videos"]:
+        files += tableFiles(channel_path.joinpath(table)) + tableParts(channel_path.joinpath(table))
+    files += SentimentScoreStore(channel_path).parts()
+    files.append(dataset_path.joinpath(f'channel={channel_path.name}', "_metadata"))
+    return files
+
+def channelFingerprint(channel_path, content = False):
+    return fileFingerprint(channelInputFiles(channel_path), content)
+
+def readManifest(manifest_file):
+    """ Manifest of an incremental processing step (empty dict without manifest) """
+    
+    if not manifest_file.exists():
+        return dict()
+    with open(manifest_file, 'r') as f:
         return json.load(f)
+
+def writeManifest(manifest, manifest_file):
+    """ Stores manifest atomically (written after the outputs it describes) """
     
-            
+    part_file = manifest_file.with_name(manifest_file.name + ".part")
+    with open(part_file, 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    os.replace(part_file, manifest_file)
+
+
+# =============================================================================
+# Response times (comment published - video published)
+# Integer offsets in whole units (hours, days) are computed directly from the
+# timestamps, same bins as pd.cut on unit edges with include_lowest=True:
+# [0, 1 unit], (1, 2 units], ... A histogram per video (fixed number of units)
+# is built once, any window (first hour, first day, first week) is a prefix sum.
+# Hourly bins nest in daily bins, one hourly histogram serves all windows.
+# =============================================================================
+
+def responseOffsets(response_times, unit = pd.Timedelta(days = 1)):
+    """
+    Bin of each response time in whole units: ceil(t / unit) - 1, t = 0 in bin 0.
+    Negative response times and NaT get -1 (excluded).
+
+    Parameters:
+            response_times (Series): timedelta
+            unit (Timedelta): bin width
+    Returns:
+            offsets (ndarray): int64
+    """
+
+    ns = pd.to_timedelta(response_times).to_numpy(dtype = "timedelta64[ns]").astype("int64")
+    step = pd.Timedelta(unit).value
+
+    offsets = np.where(ns > 0, (ns - 1) // step, 0)
+    offsets[ns < 0] = -1  # NaT is the smallest int64
+    return offsets
+
+def responseHistograms(video_ids, response_times, unit = pd.Timedelta(hours = 1), n_bins = 28 * 24):
+    """
+    Number of comments per video and response time bin (first n_bins units after
+    publication of the video, later comments are not counted).
+
+    Parameters:
+            video_ids (Series): videoId per comment
+            response_times (Series): response time per comment
+            unit (Timedelta): bin width
+            n_bins (int): number of bins
+    Returns:
+            histograms (DataFrame): videoId x bins (0 ... n_bins-1), videos with comments only
+    """
+
+    offsets = responseOffsets(response_times, unit)
+    codes, uniques = pd.factorize(video_ids)
+
+    valid = (codes >= 0) & (offsets >= 0) & (offsets < n_bins)
+    counts = np.bincount(codes[valid] * n_bins + offsets[valid], minlength = len(uniques) * n_bins)
+
+    return pd.DataFrame(counts.reshape(len(uniques), n_bins),
+                        index = pd.Index(np.asarray(uniques, dtype = object), name = "videoId"))
+
+def windowShare(histograms, window, horizon = None):
+    """
+    Share of comments within the first window bins of the comments within the first
+    horizon bins (default: all bins) per video, see responseHistograms(). Videos without
+    comments in the window get NaN (not 0).
+
+    Example:
+        hourly histograms of 4 weeks, share of the 1st day: windowShare(histograms, 24)
+    """
+
+    cumulative = histograms.to_numpy().cumsum(axis = 1)
+    in_window = cumulative[:, window - 1]
+    in_horizon = cumulative[:, (horizon or histograms.shape[1]) - 1]
+
+    share = pd.Series(in_window / np.maximum(in_horizon, 1), index = histograms.index)
+    return share.where(in_window > 0)
+
+
+# =============================================================================
+# Video features from comments (declarative registry)
+# Each feature names a filter (query on comments) and an aggregation of a column.
+# All features are computed in one grouped pass (group codes of videoId and each
+# filter mask are computed once). Empty groups (no comments passing the filter)
+# give NaN, not 0. Features starting with "_" are helpers and not returned.
+# =============================================================================
+
+VIDEO_FILTERS = {"all": None,
+                 "user": "owner_comment == False",
+                 "owner": "owner_comment == True",
+                 "user_toplevel": "owner_comment == False & top_level_comment == True",
+                 "user_replies": "owner_comment == False & top_level_comment == False",
+                 "user_toplevel_neutral": "owner_comment == False & top_level_comment == True & prediction == 'neutral'"}
+
+# name: (filter, aggregation, column), aggregations: size, count, mean, median, nunique
+VIDEO_FEATURES = {"available_comments": ("all", "size", None),
+                  "_n_user_comments": ("user", "size", None),
+                  "_n_owner_comments": ("owner", "size", None),
+                  "mean_word_count": ("user", "median", "comment_word_count"),
+                  "n_toplevel_user_comments": ("user_toplevel", "size", None),
+                  "n_user_replies": ("user_replies", "size", None),
+                  "n_toplevel_neutrals": ("user_toplevel_neutral", "size", None),
+                  "toplevel_sentiment_mean": ("user_toplevel", "mean", "prediction_num"),
+                  "replies_sentiment_mean": ("user_replies", "mean", "prediction_num"),
+                  "_n_user_comments_with_author": ("user", "count", "comment_author"),
+                  "_n_user_authors": ("user", "nunique", "comment_author")}
+
+# name: function of the features above (in order, may use previous derived features)
+DERIVED_VIDEO_FEATURES = {
+    # Owner comments per 1000 comments (NaN without owner or user comments)
+    "mod_activity": lambda f: f["_n_owner_comments"] / (f["_n_owner_comments"] + f["_n_user_comments"]) * 1000,
+    "ratio_RepliesToplevel": lambda f: f["n_user_replies"] / f["n_toplevel_user_comments"],
+    "toplevel_neutrality": lambda f: f["n_toplevel_neutrals"] / f["n_toplevel_user_comments"],
+    "comments_per_author": lambda f: f["_n_user_comments_with_author"] / f["_n_user_authors"]}
+
+def videoFeatures(comments, features = VIDEO_FEATURES, derived = DERIVED_VIDEO_FEATURES,
+                  filters = VIDEO_FILTERS):
+    """
+    Computes video features of the registry (see VIDEO_FEATURES) in one grouped pass.
+
+    Parameters:
+            comments (DataFrame): comments incl. columns used by filters and features
+            features (dict): name: (filter, aggregation, column)
+            derived (dict): name: function of the feature frame
+            filters (dict): name: query string (None: all comments)
+    Returns:
+            video_features (DataFrame): one row per videoId of comments
+    """
+
+    codes, video_ids = pd.factorize(comments["videoId"])
+    n_videos = len(video_ids)
+
+    masks = dict()
+    for filter_name in set(filter_name for filter_name, _, _ in features.values()):
+        query = filters[filter_name]
+        mask = np.ones(len(comments), dtype = bool) if query is None else \
+               comments.eval(query).fillna(False).to_numpy(dtype = bool)
+        masks[filter_name] = mask & (codes >= 0)
+
+    def groupCounts(group_codes):
+        counts = np.bincount(group_codes, minlength = n_videos)
+        # Empty groups are missing (as in groupby)
+        return counts if counts.all() else np.where(counts > 0, counts, np.nan)
+
+    values = dict()
+    for name, (filter_name, aggregation, column) in features.items():
+        mask = masks[filter_name]
+
+        if aggregation == "size":
+            values[name] = groupCounts(codes[mask])
+            continue
+
+        if aggregation in ["mean", "median"]:
+            x = comments[column].to_numpy(dtype = "float64", na_value = np.nan)
+            mask = mask & ~np.isnan(x)
+        else:
+            mask = mask & comments[column].notna().to_numpy()
+
+        if aggregation == "count":
+            values[name] = groupCounts(codes[mask])
+
+        elif aggregation == "mean":
+            sums = np.bincount(codes[mask], weights = x[mask], minlength = n_videos)
+            counts = np.bincount(codes[mask], minlength = n_videos)
+            with np.errstate(invalid = "ignore", divide = "ignore"):
+                values[name] = np.where(counts > 0, sums / counts, np.nan)
+
+        elif aggregation == "median":
+            medians = pd.Series(x[mask]).groupby(codes[mask]).median()
+            values[name] = medians.reindex(range(n_videos)).to_numpy()
+
+        elif aggregation == "nunique":
+            # Distinct (video, value) pairs, counted per video
+            value_codes, uniques = pd.factorize(comments[column])
+            pairs = np.unique(codes[mask].astype("int64") * len(uniques) + value_codes[mask])
+            values[name] = groupCounts(pairs // len(uniques))
+
+        else:
+            raise ValueError(f'unknown aggregation "{aggregation}" of feature {name}')
+
+    video_features = pd.DataFrame(values, index = pd.Index(np.asarray(video_ids, dtype = object), name = "videoId"))
+    for name, func in derived.items():
+        video_features[name] = func(video_features)
+
+    return video_features[[column for column in video_features.columns if not column.startswith("_")]]
+
+
 # =============================================================================
 # Other outsourced stuff             
 # =============================================================================
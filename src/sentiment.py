@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+"""
+Batched sentiment scoring of comments (model "germansentiment", see sentiment_analysis.py).
+Comments are passed to the model batch_size at a time, results are written into
+preallocated arrays and returned as one DataFrame (no row-wise concatenation).
+Scores of already seen texts are taken from a persistent SentimentCache.
+ShardedScorer spreads scoring over worker processes (one model per process).
+Inference backends (loadBackend): "eager" (float32 reference) and "int8" (dynamically
+quantized linear layers), model "tiny" is a random stand-in for offline tests.
+"""
+import os
+import re
+import copy
+import time
+import string
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+# Columns added by sentiment analysis (probability columns named after model labels)
+SENTIMENT_LABELS = ["positive", "negative", "neutral"]
+
+DEFAULT_MODEL = "oliverguhr/german-sentiment-bert"
+
+# =============================================================================
+# Inference backends
+# Same interface as germansentiment.SentimentModel (predict_sentiment, clean_text,
+# model, tokenizer), thus usable wherever a SentimentModel is expected.
+# =============================================================================
+
+class TransformerBackend:
+
+    """
+    Eager PyTorch inference in float32 (reference backend).
+
+            Parameters:
+                    model (PreTrainedModel): sequence classification model (id2label in config)
+                    tokenizer (PreTrainedTokenizer): tokenizer of model
+                    clean_text (callable): text normalization (default: cleanText)
+                    model_id (str): identity used for cache keys (default: model name)
+                    device (str): "cpu" or "cuda"
+    """
+
+    backend = "eager"
+
+    def __init__(self, model, tokenizer, clean_text = None, model_id = None, device = "cpu"):
+        self.model = model.to(device).eval()
+        self.tokenizer = tokenizer
+        self.clean_text = clean_text or cleanText
+        self.device = device
+        self.model_id = model_id or getattr(model, "name_or_path", None) or type(model).__name__
+
+    @classmethod
+    def fromSentimentModel(cls, sentiment_model):
+        return cls(sentiment_model.model, sentiment_model.tokenizer, sentiment_model.clean_text,
+                   device = sentiment_model.device)
+
+    def predict_sentiment(self, texts, output_probabilities = False):
+        """ Same output as SentimentModel.predict_sentiment() """
+
+        import torch
+
+        texts = [self.clean_text(text) for text in texts]
+        encoded = self.tokenizer(texts, padding = True, add_special_tokens = True,
+                                 truncation = True, return_tensors = "pt").to(self.device)
+        with torch.no_grad():
+            logits = self.model(**encoded)[0]
+
+        id2label = self.model.config.id2label
+        labels = [id2label[label_id] for label_id in torch.argmax(logits, axis = 1).tolist()]
+        if not output_probabilities:
+            return labels
+
+        probabilities = torch.softmax(logits, dim = -1).tolist()
+        return labels, [[[id2label[index], item] for index, item in enumerate(prediction)]
+                        for prediction in probabilities]
+
+class QuantizedBackend(TransformerBackend):
+
+    """
+    CPU inference with linear layers dynamically quantized to int8 (weights int8,
+    activations quantized on the fly). Output schema as TransformerBackend, scores
+    differ slightly (and depend on the batch composition), see checkAgreement().
+    Parameters as TransformerBackend.
+    """
+
+    backend = "int8"
+
+    def __init__(self, model, tokenizer, clean_text = None, model_id = None, device = "cpu"):
+        import torch
+
+        model_id = model_id or getattr(model, "name_or_path", None) or type(model).__name__
+        quantized = torch.quantization.quantize_dynamic(copy.deepcopy(model).to("cpu").eval(),
+                                                        {torch.nn.Linear}, dtype = torch.qint8)
+        super().__init__(quantized, tokenizer, clean_text, f'{model_id}+int8', device = "cpu")
+
+BACKENDS = {"eager": TransformerBackend, "int8": QuantizedBackend}
+
+# Text normalization of germansentiment 1.1.0 (SentimentModel.clean_text)
+_clean_chars = re.compile(r'[^A-Za-züöäÖÜÄß ]', re.MULTILINE)
+_clean_http_urls = re.compile(r'https*\S+', re.MULTILINE)
+_clean_at_mentions = re.compile(r'@\S+', re.MULTILINE)
+_numbers = {"0": " null", "1": " eins", "2": " zwei", "3": " drei", "4": " vier",
+            "5": " fünf", "6": " sechs", "7": " sieben", "8": " acht", "9": " neun"}
+
+def cleanText(text):
+    text = text.replace("\n", " ")
+    text = _clean_http_urls.sub('', text)
+    text = _clean_at_mentions.sub('', text)
+    for number, word in _numbers.items():
+        text = text.replace(number, word)
+    text = _clean_chars.sub('', text)
+    text = ' '.join(text.split())
+    return text.strip().lower()
+
+def tinySentimentModel(seed = 0, hidden_size = 64, num_layers = 2):
+    """
+    Randomly initialized BERT classifier with a generated German vocabulary (letters,
+    word pieces, frequent words). Same interface and labels as the real model, but
+    meaningless scores. Deterministic for a given seed (e.g. in all worker processes).
+    """
+
+    import torch
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+    letters = string.ascii_lowercase + "äöüß"
+    words = ("der die das und ist nicht ich du er sie es wir ihr ein eine zu mit auf "
+             "für von sehr gut schlecht toll super danke video kanal frage mehr immer "
+             "schon aber auch noch nur so wie was warum wer hier da dann leider richtig").split()
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(letters) + ["##" + c for c in letters] + words
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vocab_file = Path(tmp).joinpath("vocab.txt")
+        vocab_file.write_text("\n".join(vocab))
+        tokenizer = BertTokenizerFast(str(vocab_file), model_max_length = 512)
+
+    config = BertConfig(vocab_size = len(vocab), hidden_size = hidden_size,
+                        num_hidden_layers = num_layers, num_attention_heads = 4,
+                        intermediate_size = hidden_size * 4, max_position_embeddings = 512,
+                        num_labels = len(SENTIMENT_LABELS),
+                        id2label = dict(enumerate(SENTIMENT_LABELS)),
+                        label2id = {label: i for i, label in enumerate(SENTIMENT_LABELS)})
+
+    with torch.random.fork_rng():
+        torch.manual_seed(seed)
+        model = BertForSequenceClassification(config)
+
+    return TransformerBackend(model, tokenizer, model_id = f'tiny-random-bert-{seed}')
+
+def loadBackend(backend = "eager", model_name = DEFAULT_MODEL):
+    """
+    Loads a sentiment model with the given inference backend.
+
+            Parameters:
+                    backend (str): "eager" (float32 reference) or "int8" (quantized)
+                    model_name (str): hub name of a germansentiment model or "tiny"
+                                      (random stand-in, see tinySentimentModel())
+            Returns:
+                    sentiment_model (TransformerBackend)
+    """
+
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend "{backend}", available: {list(BACKENDS)}')
+
+    if model_name == "tiny":
+        reference = tinySentimentModel()
+    else:
+        from germansentiment import SentimentModel
+        reference = TransformerBackend.fromSentimentModel(SentimentModel(model_name))
+
+    if backend == "eager":
+        return reference
+    return BACKENDS[backend](reference.model, reference.tokenizer, reference.clean_text, reference.model_id)
+
+# =============================================================================
+# Persistent cache of scores (content-addressed)
+# =============================================================================
+
+def modelId(sentiment_model):
+    """ Identity of a loaded model (hub name or local path, plus backend), part of each cache key """
+
+    model_id = getattr(sentiment_model, "model_id", None)
+    if model_id:
+        return model_id
+    return getattr(sentiment_model.model, "name_or_path", None) or type(sentiment_model.model).__name__
+
+class SentimentCache:
+
+    """
+    Stores label and probabilities per text in a sqlite file. Keys are hashes of the
+    model identity and the normalized text (the text the model actually sees, i.e.
+    after SentimentModel.clean_text), thus "Danke!" and "danke" share one entry.
+    Least recently used entries are evicted once max_entries is exceeded.
+    Instances can be shared by threads (e.g. channels analyzed in parallel).
+
+            Parameters:
+                    cache_file (PosixPath): sqlite file (created if missing)
+                    model_id (str): model identity, see modelId()
+                    max_entries (int): size bound (number of texts)
+    """
+
+    def __init__(self, cache_file, model_id, max_entries = 1000000):
+        self.cache_file = cache_file
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(cache_file, check_same_thread = False)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS scores (
+                                   key TEXT PRIMARY KEY, prediction TEXT,
+                                   positive REAL, negative REAL, neutral REAL,
+                                   last_used REAL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+        self.connection.commit()
+
+    def key(self, normalized_text):
+        return hashlib.sha256(f'{self.model_id}\0{normalized_text}'.encode()).hexdigest()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def get(self, keys, chunk_size = 500):
+        """ Returns {key: (prediction, positive, negative, neutral)} of all cached keys """
+
+        keys = list(keys)
+        found = dict()
+        now = time.time()
+
+        with self.lock:
+            # sqlite limits the number of query parameters
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, prediction, positive, negative, neutral FROM scores WHERE key IN ({placeholders})",
+                    chunk)
+                found.update({row[0]: row[1:] for row in rows})
+                self.connection.execute(
+                    f"UPDATE scores SET last_used = ? WHERE key IN ({placeholders})", [now] + chunk)
+
+            self.connection.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, scores):
+        """ Stores {key: (prediction, positive, negative, neutral)}, evicts if necessary """
+
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?)",
+                [(key, *score, now) for key, score in scores.items()])
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        n_entries = self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        n_evict = n_entries - self.max_entries
+        if n_evict > 0:
+            self.connection.execute(
+                "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY last_used LIMIT ?)",
+                (n_evict,))
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def close(self):
+        self.connection.close()
+
+# =============================================================================
+# Batched scoring
+# =============================================================================
+
+def tokenLengths(texts, sentiment_model):
+    """ Number of tokens per text as seen by the model (cleaned, incl. special tokens, truncated) """
+
+    tokenizer = getattr(sentiment_model, "tokenizer", None)
+    normalize = getattr(sentiment_model, "clean_text", str)
+    texts = [normalize(text) for text in texts]
+
+    if tokenizer is None:
+        return np.array([len(text.split()) + 2 for text in texts], dtype = "int64")
+
+    input_ids = tokenizer(texts, add_special_tokens = True, truncation = True)["input_ids"]
+    return np.array([len(ids) for ids in input_ids], dtype = "int64")
+
+def tokenBudgetBatches(lengths, max_tokens, batch_size = None):
+    """
+    Groups texts of similar length (sorted by token length) into batches of at most
+    max_tokens padded tokens (batch size x longest text) and at most batch_size texts.
+    Texts longer than max_tokens form a batch of their own. Returns list of index 
+    arrays (positions in lengths).
+    """
+
+    order = np.argsort(lengths, kind = "stable")
+    batches = []
+    batch_start = 0
+
+    for i in range(1, len(order) + 1):
+        # Sorted ascending, thus the padded length of a batch is the length of its last text
+        if (i == len(order) or (i + 1 - batch_start) * lengths[order[i]] > max_tokens
+                or (batch_size and i - batch_start >= batch_size)):
+            batches.append(order[batch_start:i])
+            batch_start = i
+
+    return batches
+
+def predictTexts(texts, sentiment_model, batch_size = 64, name = "comments", report = True,
+                 max_tokens = None, stats = None):
+    """
+    Runs the model on texts in batches. Returns predictions (array of labels) and
+    probabilities (array n x 3, columns as SENTIMENT_LABELS) in the order of texts.
+    With max_tokens, batches are built from texts of similar token length under a
+    token budget (less padding, still at most batch_size texts) instead of batch_size 
+    consecutive texts.
+    Padding efficiency (tokens / padded tokens) is reported and added to stats (dict),
+    as well as seconds per model call (stats["batch_seconds"]).
+    """
+
+    n_texts = len(texts)
+    predictions = np.empty(n_texts, dtype = object)
+    probabilities = np.empty((n_texts, len(SENTIMENT_LABELS)), dtype = "float64")
+
+    lengths = tokenLengths(texts, sentiment_model)
+    if max_tokens:
+        batches = tokenBudgetBatches(lengths, max_tokens, batch_size)
+    else:
+        batches = [np.arange(i, min(i + batch_size, n_texts)) for i in range(0, n_texts, batch_size)]
+
+    report_every = max(1, n_texts // 100)  # progress in percent steps
+    next_report = report_every
+    done = tokens = padded_tokens = 0
+    batch_seconds = []
+    start = time.time()
+
+    for batch in batches:
+
+        batch_start = time.time()
+        labels, label_probabilities = sentiment_model.predict_sentiment([texts[i] for i in batch], True)
+        batch_seconds.append(time.time() - batch_start)
+
+        # Results are scattered back to the positions of the texts
+        predictions[batch] = labels
+
+        # Probabilities are returned as [[label, probability], ...] in model label order
+        for i, text_probabilities in zip(batch, label_probabilities):
+            text_probabilities = dict(text_probabilities)
+            probabilities[i] = [text_probabilities[label] for label in SENTIMENT_LABELS]
+
+        done += len(batch)
+        tokens += lengths[batch].sum()
+        padded_tokens += len(batch) * lengths[batch].max()
+        if report and (done >= next_report or done == n_texts):
+            seconds = time.time() - start
+            print(f'{name} | {round(done / n_texts, 3)} done | '
+                  f'{round(done / seconds, 1)} comments per sec | '
+                  f'padding efficiency {round(tokens / padded_tokens * 100, 1)}%')
+            next_report = done + report_every
+
+    if stats is not None:
+        stats["tokens"] = stats.get("tokens", 0) + int(tokens)
+        stats["padded_tokens"] = stats.get("padded_tokens", 0) + int(padded_tokens)
+        stats["batches"] = stats.get("batches", 0) + len(batches)
+        stats["batch_seconds"] = stats.get("batch_seconds", []) + batch_seconds
+
+    return predictions, probabilities
+
+# =============================================================================
+# Multi-process scoring (shards of texts, one model per worker process)
+# =============================================================================
+
+_worker_model = None
+
+def initScoringWorker(model_factory, torch_threads):
+    """ Initializer of worker processes: pins torch threads, loads the model once """
+
+    global _worker_model
+    import torch
+    torch.set_num_threads(torch_threads)
+    _worker_model = model_factory()
+
+def scoreShard(texts, batch_size, max_tokens = None):
+    stats = dict()
+    predictions, probabilities = predictTexts(texts, _worker_model, batch_size, report = False,
+                                              max_tokens = max_tokens, stats = stats)
+    return predictions, probabilities, stats
+
+class ShardedScorer:
+
+    """
+    Pool of worker processes, each holding its own model. Texts are split into shards,
+    results are returned in the original order. Workers are started with "spawn"
+    (scripts using it need an if __name__ == "__main__" guard).
+
+            Parameters:
+                    model_factory (callable): returns a loaded model, e.g. SentimentModel
+                    n_workers (int): number of worker processes (default: all cores)
+                    torch_threads (int): torch intra-op threads per worker
+                                         (default: cores / n_workers, no oversubscription)
+    """
+
+    def __init__(self, model_factory, n_workers = None, torch_threads = None):
+        self.n_workers = n_workers or os.cpu_count()
+        self.torch_threads = torch_threads or max(1, os.cpu_count() // self.n_workers)
+        self.executor = ProcessPoolExecutor(max_workers = self.n_workers,
+                                            mp_context = multiprocessing.get_context("spawn"),
+                                            initializer = initScoringWorker,
+                                            initargs = (model_factory, self.torch_threads))
+
+    def predictTexts(self, texts, batch_size = 64, name = "comments", shard_size = None,
+                     max_tokens = None, stats = None, report = True):
+        """ Same as predictTexts(), shards of shard_size texts are scored in parallel """
+
+        shard_size = shard_size or batch_size * 8
+        futures = [self.executor.submit(scoreShard, texts[i:i + shard_size], batch_size, max_tokens)
+                   for i in range(0, len(texts), shard_size)]
+        stats = stats if stats is not None else dict()
+
+        predictions = [np.empty(0, dtype = object)]
+        probabilities = [np.empty((0, len(SENTIMENT_LABELS)), dtype = "float64")]
+        report_every = max(1, len(texts) // 100)
+        next_report = report_every
+        done = 0
+        start = time.time()
+
+        # Collected in shard order
+        for future in futures:
+            shard_predictions, shard_probabilities, shard_stats = future.result()
+            predictions.append(shard_predictions)
+            probabilities.append(shard_probabilities)
+            for key, value in shard_stats.items():
+                stats[key] = stats[key] + value if key in stats else value
+
+            done += len(shard_predictions)
+            if report and (done >= next_report or done == len(texts)):
+                print(f'{name} | {round(done / len(texts), 3)} done | '
+                      f'{round(done / (time.time() - start), 1)} comments per sec | '
+                      f'padding efficiency {round(stats["tokens"] / stats["padded_tokens"] * 100, 1)}%')
+                next_report = done + report_every
+
+        return np.concatenate(predictions), np.concatenate(probabilities)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def scoreComments(comments, sentiment_model, batch_size = 64, name = "comments", cache = None,
+                  scorer = None, max_tokens = None):
+    """
+    Estimates sentiment of comments in batches. With a cache, only texts not seen
+    before reach the model (each distinct text once), new scores are added to the cache.
+    With a scorer, texts are scored by its worker processes instead of sentiment_model.
+
+            Parameters:
+                    comments (Series): comment strings (e.g. comments["comment_string"])
+                    sentiment_model (SentimentModel): loaded germansentiment model
+                    batch_size (int): comments per model call (see also max_tokens)
+                    name (str): used for progress reporting (e.g. channel title)
+                    cache (SentimentCache): optional, scores of already seen texts
+                    scorer (ShardedScorer): optional, multi-process scoring
+                    max_tokens (int): optional, padded tokens per model call, batches of
+                                      similar length texts of at most batch_size 
+                                      (see tokenBudgetBatches())
+
+            Returns:
+                    sentiments (DataFrame): "prediction", "positive", "negative", "neutral"
+                                            with the index of comments
+    """
+
+    texts = [str(comment) for comment in comments]
+
+    def runModel(texts):
+        if scorer is not None:
+            return scorer.predictTexts(texts, batch_size, name, max_tokens = max_tokens)
+        return predictTexts(texts, sentiment_model, batch_size, name, max_tokens = max_tokens)
+
+    if cache is None:
+        predictions, probabilities = runModel(texts)
+
+    else:
+        # One key per distinct normalized text, first text of each key is scored
+        normalize = getattr(sentiment_model, "clean_text", str)
+        keys = [cache.key(normalize(text)) for text in texts]
+        unique_texts = dict(zip(reversed(keys), reversed(texts)))
+        scores = cache.get(unique_texts)
+
+        unseen = [key for key in unique_texts if key not in scores]
+        if unseen:
+            new_predictions, new_probabilities = runModel([unique_texts[key] for key in unseen])
+            new_scores = {key: (prediction, *probability) for key, prediction, probability
+                          in zip(unseen, new_predictions, new_probabilities.tolist())}
+            cache.put(new_scores)
+            scores.update(new_scores)
+
+        print(f'{name} | {len(texts) - len(unseen)} of {len(texts)} comments without inference | '
+              f'cache hit rate {round(cache.hitRate() * 100, 1)}% | {len(cache)} cached texts')
+
+        predictions = np.array([scores[key][0] for key in keys], dtype = object)
+        probabilities = np.array([scores[key][1:] for key in keys], dtype = "float64")
+        probabilities = probabilities.reshape(len(keys), len(SENTIMENT_LABELS))
+
+    sentiments = pd.DataFrame(probabilities, columns = SENTIMENT_LABELS, index = comments.index)
+    sentiments.insert(0, "prediction", predictions)
+    return sentiments
+
+# =============================================================================
+# Agreement of backends
+# =============================================================================
+
+def checkAgreement(reference, candidate, texts, batch_size = 64, min_agreement = 0.99):
+    """
+    Scores texts with both models and compares the results.
+
+            Parameters:
+                    reference (model): reference backend (e.g. loadBackend("eager"))
+                    candidate (model): backend to check (e.g. loadBackend("int8"))
+                    texts (list): sample of comment strings
+                    batch_size (int): comments per model call
+                    min_agreement (float): required share of identical labels
+
+            Returns:
+                    agreement (dict): label agreement, max and mean absolute probability
+                                      difference, passed (bool)
+    """
+
+    texts = [str(text) for text in texts]
+    reference_labels, reference_probabilities = predictTexts(texts, reference, batch_size, report = False)
+    candidate_labels, candidate_probabilities = predictTexts(texts, candidate, batch_size, report = False)
+
+    differences = np.abs(reference_probabilities - candidate_probabilities)
+    agreement = {"texts": len(texts),
+                 "label_agreement": float((reference_labels == candidate_labels).mean()) if texts else 1.0,
+                 "max_abs_diff": float(differences.max()) if texts else 0.0,
+                 "mean_abs_diff": float(differences.mean()) if texts else 0.0}
+    agreement["passed"] = agreement["label_agreement"] >= min_agreement
+
+    print(f'{modelId(candidate)} vs. {modelId(reference)} | {agreement}')
+    return agreement
@@ -1,285 +1,301 @@
 import json
 import numpy as np
 import pandas as pd
-from src.funcs import first_key, project_path, storage_path, processed_path
-from src.funcs import concatCommentsAndVideos, getChannelMetrics, exportDFdtypes
+from pathlib import Path
+from src.funcs import project_path, storage_path, processed_path, KeyPool
+from src.funcs import concatCommentsAndVideos, getChannelMetrics, writeTable, readTable
+from src.funcs import tableExists, removeTable, channelHasComments
+from src.funcs import fileFingerprint, channelFingerprint, readManifest, writeManifest
+from src.funcs import compactComments, reportMemory
+from src.funcs import responseHistograms, windowShare, videoFeatures
 
 # =============================================================================
-# Data import of csv files (the ones generated in interim/@channel)
+# Data import of tables (the ones generated in interim/@channel)
 # =============================================================================
 
-channel_paths = [x for x in storage_path.iterdir() if x.is_dir()]
-print(f'found {len(channel_paths)} folders / channels.')
-comments, videos = concatCommentsAndVideos(channel_paths)
-
-# Assign / create features
-comments["owner_comment"] = comments["comment_author"] == comments["videoOwnerChannelTitle"]
-comments["comment_word_count"] = comments["comment_string"].apply(lambda x: len(str(x).split()))
-comments["comments_published_year"] = pd.DatetimeIndex(comments["comment_published"]).year
-comments["response_time"] = (pd.to_datetime(comments["comment_published"]) -
-                             pd.to_datetime(comments["publishedAt"]))
-
-comments = comments.reset_index(drop=True)
-
-
-
-# =============================================================================
-# Feature engineering (video)
-# Available and removed comments (in total and in percent)
-# =============================================================================
-available_comments = comments.groupby("videoId", dropna=False).size()
-available_comments.name = "available_comments"
-
-videos = videos.join(available_comments).sort_values("available_comments")
-videos["removed_comments"] = (videos["commentCount"] - videos["available_comments"])
-videos["removed_comments_perc"] = videos["removed_comments"] / videos["commentCount"] * 100
-
-# =============================================================================
-# Feature engineering (video)
-# Median comment length
-# =============================================================================
-user_comments = comments.query("owner_comment == False")
-videos["mean_word_count"] = user_comments.groupby("videoId").agg({"comment_word_count":"median"})
-
-# =============================================================================
-# Feature engineering (video)
-# Moderation activity per video (owner_comments per 1000 user comments)
-# =============================================================================
-moderation_activity = comments.groupby(["videoId", "owner_comment"]).size().reset_index()
-moderation_activity = (moderation_activity
-                      .pivot(index = "videoId", columns = "owner_comment", values = 0)
-                      .reset_index())
-
-moderation_activity = moderation_activity.T.reset_index(drop=True).T
-moderation_activity.columns = ["videoId", "False", "True"]
-moderation_activity["mod_activity"] = (
-    moderation_activity["True"] / (moderation_activity["False"] + moderation_activity["True"])
-    * 1000
-)
+# Compact dtypes (categoricals, Arrow strings, float32 scores, nullable ints)
+# NOTE: groupby on categorical columns requires observed=True (no empty groups)
+compact = True
+
+# Only channels with changed inputs (comments, videos, sentiment scores) are transformed,
+# their rows are replaced in processed/ (see below). False transforms all channels.
+incremental = True
+
+# Additionally export csv files (+ dtypes json)
+export_csv = False
+
+key_pool = KeyPool.fromEnv()
+
+def transformChannels(channel_paths):
+    """
+    Creates comment, video and channel features of the given channels.
+
+    Parameters:
+            channel_paths (list): channel folders (data/interim/@channel) with comments 
+                                  and all_videos
+    Returns:
+            channels (DataFrame): channel features (index channelId)
+            videos (DataFrame): video features (index videoId)
+            comments (DataFrame): comments incl. features
+    """
+    comments, videos = concatCommentsAndVideos(channel_paths, compact = compact)
+
+    # Assign / create features
+    comments["owner_comment"] = (comments["comment_author"].astype(object) == 
+                                comments["videoOwnerChannelTitle"].astype(object))
+    comments["comment_word_count"] = comments["comment_string"].apply(lambda x: len(str(x).split()))
+    comments["comments_published_year"] = pd.DatetimeIndex(comments["comment_published"]).year
+    comments["response_time"] = (pd.to_datetime(comments["comment_published"]) -
+                                 pd.to_datetime(comments["publishedAt"]))
+
+    comments = comments.reset_index(drop=True)
+    if compact:
+        comments = compactComments(comments)
+
+
+
+    # Transforming sentiment into numerical feature
+    comments["prediction_num"] = (
+                              comments["prediction"]
+                             .astype("category")
+                             .cat.rename_categories({'positive': 1,
+                                                     'neutral': 0.5,
+                                                     'negative': 0})
+                             .astype("double")
+                            )
+
+    # =============================================================================
+    # Feature engineering (video)
+    # Features from comments in one grouped pass, see VIDEO_FEATURES in src/funcs.py:
+    # available comments, median comment length of user comments, moderation activity 
+    # (owner comments per 1000 comments), top level user comments and user replies 
+    # (and their ratio), neutrality of top level user comments, sentiment index 
+    # (separately for top level comments and replies), comments per author
+    # =============================================================================
+    videos = videos.join(videoFeatures(comments)).sort_values("available_comments")
+
+    # Available and removed comments (in total and in percent)
+    videos["removed_comments"] = (videos["commentCount"] - videos["available_comments"])
+    videos["removed_comments_perc"] = videos["removed_comments"] / videos["commentCount"] * 100
+
+    videos["replies_sentiment_mean"] = round(videos["replies_sentiment_mean"], 3)
+
+    # Remove sentiment estimation for videos with insufficient comment amount 
+    videos["toplevel_sentiment_mean"].mask(videos["n_toplevel_user_comments"] < 50,
+                                           "NaN",
+                                           inplace = True)
+
+    # =============================================================================
+    # Feature engineering (video)
+    # Responsivity
+    # =============================================================================
+
+    user_comments = comments.query("owner_comment == False")
+
+    # Hourly histogram of response times per video (first 4 weeks), 
+    # windows are taken from the histogram (e.g. 1st hour: window = 1, 1st week: 7 * 24)
+    response_histograms = responseHistograms(user_comments["videoId"], 
+                                             user_comments["response_time"],
+                                             unit = pd.Timedelta(hours = 1),
+                                             n_bins = 4 * 7 * 24)
+
+    # Share of comments during the 1st day (of comments during the first 4 weeks)
+    videos["responsivity"] = windowShare(response_histograms, window = 24)
+
+    # =============================================================================
+    # Feature engineering (video)
+    # Likes and comments per 1000 views
+    # =============================================================================
+    videos["likes_per_1kViews"] = videos["likeCount"] / videos["viewCount"] * 1000
+    videos["comments_per_1kViews"] = videos["commentCount"] / videos["viewCount"] * 1000
+
+    videos["likes_per_1kViews"] = videos["likes_per_1kViews"].replace([np.inf], np.nan)
+    videos["comments_per_1kViews"] = videos["comments_per_1kViews"].replace([np.inf], np.nan)
+
+    # =============================================================================
+    # Add video url
+    # =============================================================================
+    URL_PREFIX = "https://www.youtube.com/watch?v="
+    videos["video_url"] =  URL_PREFIX + videos.index
+
+    # =============================================================================
+    # Convert YT categories
+    # =============================================================================
+
+    # Categories can be fetched from the API as well
+    # id_dict = dict()
+    # for item in response["items"]:
+    #     id_dict.update({item["id"]: item["snippet"]["title"]})
+
+    with open(project_path.joinpath("references", "youtube_categories.json"), 'r') as filepath:
+        categories_dict = json.load(filepath)
+
+    videos["categoryId"] = videos["categoryId"].apply(str)
+    videos["categoryId"].replace(categories_dict, inplace=True)
+
+    # =============================================================================
+    # Dataframe cleanups
+    # =============================================================================
+
+    comments["response_time_sec"] = comments["response_time"].dt.total_seconds()
+    comments = comments.drop(columns=["response_time"], axis = 1)
+    if compact:
+        comments = compactComments(comments)
+    reportMemory(comments, "comments")
+    #comments = comments.set_index("comment_id")
+
+    videos["removed_comments_perc"] = round(videos["removed_comments_perc"], 1)
+    videos["likes_per_1kViews"] = round(videos["likes_per_1kViews"], 1)
+    videos["comments_per_1kViews"] = round(videos["comments_per_1kViews"], 1)
+    videos["responsivity"] = round(videos["responsivity"] * 100, 1)
+    videos["duration"] = pd.to_timedelta(videos["duration"]).dt.total_seconds()
+
+    convert_dict = {"mod_activity" : float,
+                    "toplevel_sentiment_mean" : float,
+                    "duration" : int}
+    videos = videos.astype(convert_dict)
+
+    # =============================================================================
+    # Channel-wide features
+    # =============================================================================
+
+    # Get basic metrics
+    channelIds = list(videos["videoOwnerChannelId"].unique())
+    channels = pd.DataFrame()
+
+    for channelId in channelIds:
+        _ = getChannelMetrics(channelId, key_pool)[0]
+        _ = pd.DataFrame.from_dict(_, orient = "index").T
+        channels = pd.concat([channels, _], axis = 0)
+
+    channels = channels.set_index("channelId")
+
+    # Aggregate metrics from videos
+    agg_dict = {
+          "video_url" : "size",
+          "commentCount" : "sum",
+          "available_comments" : "sum",
+          "removed_comments": "sum",
+          "likes_per_1kViews" : "mean",
+          "comments_per_1kViews": "mean",
+          "comments_per_author" : "mean",
+          "mean_word_count" : "mean",
+          "mod_activity": "mean",
+          "responsivity" : "mean",
+          "toplevel_sentiment_mean": "mean", # Note: simple average here, no weights
+          "ratio_RepliesToplevel" : "mean"
+    }
+    channels_metrics = videos.groupby("videoOwnerChannelId").agg(agg_dict)
+
+    channels_metrics["removed_comments_perc"] = (
+         channels_metrics["removed_comments"] /
+        (channels_metrics["available_comments"] + channels_metrics["removed_comments"])
+    )
+
+    # Concat aggregated metrics
+    channels = pd.concat([channels, channels_metrics], axis = 1)
+    channels = channels.rename(columns = {"video_url":"n_videos"})
+
+    return channels, videos, comments
 
-moderation_activity = moderation_activity.set_index("videoId")
 
-videos = videos.join(moderation_activity["mod_activity"]) 
 # =============================================================================
-# Feature engineering (video)
-# Ratio: Replies over top_level_user_comments
+# Incremental transform
+# Input fingerprints of each channel (see channelFingerprint()) are kept in 
+# processed/transform_manifest.json. Changed channels are transformed again and 
+# replace their rows in processed/videos and processed/channels, comments are 
+# stored per channel (processed/comments/{channel}). Changes of the transform
+# code (this file, src/funcs.py, categories) lead to a full run.
 # =============================================================================
-videos["n_toplevel_user_comments"] = (
-    user_comments.query("top_level_comment == True")
-   .groupby("videoId")
-   .size()
-)
-videos["n_user_replies"] = (
-    user_comments.query("top_level_comment == False")
-    .groupby("videoId")
-    .size()
-)
-
-videos["ratio_RepliesToplevel"] = (videos["n_user_replies"] /
-                                   videos["n_toplevel_user_comments"])
-
-# =============================================================================
-# Feature engineering (video)
-# Neutrality (derived from sentiment) 
-# =============================================================================
-
-sentiment_proportions = (user_comments
-                        .query("top_level_comment == True")
-                        .groupby(["videoId", "prediction"]).size().reset_index())
-
-n_toplevel_neutral = sentiment_proportions.pivot(index = "videoId", 
-                                                 columns = "prediction", 
-                                                 values = 0)["neutral"]
-n_toplevel_neutral.name = "n_toplevel_neutrals" 
-
-videos = videos.join(n_toplevel_neutral)
-videos["toplevel_neutrality"] = videos["n_toplevel_neutrals"] / videos["n_toplevel_user_comments"]
-
-# =============================================================================
-# Feature engineering (video)
-# Sentiment-Index (separately for top_level_comments and replies)
-# =============================================================================
-
-# Transforming sentiment into numerical feature
-comments["prediction_num"] = (
-                          comments["prediction"]
-                         .astype("category")
-                         .cat.rename_categories({'positive': 1,
-                                                 'neutral': 0.5,
-                                                 'negative': 0})
-                         .astype("double")
-                        )
-
-videos["toplevel_sentiment_mean"] = (comments.query("top_level_comment == True & owner_comment == False")
-                                    .groupby("videoId")
-                                    .agg({"prediction_num":"mean"}))   
-
-videos["replies_sentiment_mean"] = (
-    comments.query("top_level_comment == False & owner_comment == False")
-    .groupby("videoId")
-    .agg({"prediction_num": "mean"})
-    .apply(lambda x: round(x, 3))
-)
-
-# Remove sentiment estimation for videos with insufficient comment amount 
-videos["toplevel_sentiment_mean"].mask(videos["n_toplevel_user_comments"] < 50,
-                                       "NaN",
-                                       inplace = True)
-
-# =============================================================================
-# Feature engineering (video)
-# Responsivity
-# =============================================================================
-
-# Estimate time series of channel existance
-start = pd.Timedelta(0)
-end  = user_comments["comment_published"].max() - pd.to_datetime(user_comments["publishedAt"].min())
-day_slices = pd.Series([0], dtype = "timedelta64[ns]")
-
-for d in np.arange((end - start).days)+1:
-    _ = len(day_slices)
-    day_slices.loc[_] = pd.Timedelta(d, unit = "day")
-
-user_comments["response_day"] = pd.cut(user_comments["response_time"],
-                                       bins = day_slices,
-                                       include_lowest= True,
-                                       labels = np.arange(len(day_slices)-1),
-                                       ordered = True)
-
-comments_4weeks = user_comments[user_comments["response_day"] <= 27]
-filter_1st_day = comments_4weeks["response_day"] < 1
-comments_1st_day = comments_4weeks[filter_1st_day].groupby("videoId").size()
-comments_1st_day.name = "comments_1st_day"
-videos["responsivity"] = (comments_1st_day / comments_4weeks.groupby("videoId").size())
 
-# =============================================================================
-# Feature engineering (video)
-# Likes and comments per 1000 views
-# =============================================================================
-videos["likes_per_1kViews"] = videos["likeCount"] / videos["viewCount"] * 1000
-videos["comments_per_1kViews"] = videos["commentCount"] / videos["viewCount"] * 1000
-
-videos["likes_per_1kViews"] = videos["likes_per_1kViews"].replace([np.inf], np.nan)
-videos["comments_per_1kViews"] = videos["comments_per_1kViews"].replace([np.inf], np.nan)
-
-# =============================================================================
-# Feature engineering (video)
-# Comments per author
-# =============================================================================
-
-_ = user_comments.groupby(["videoId", "comment_author"]).size().reset_index()
-_ = (_.rename(columns={0: 'comments_per_author'})
-      .sort_values(["videoId", "comments_per_author"], ascending = False))
-
-comments_per_author = _.groupby("videoId").agg({"comments_per_author" : "mean"})
-videos = videos.join(comments_per_author)
-
-# =============================================================================
-# Add video url
-# =============================================================================
-URL_PREFIX = "https://www.youtube.com/watch?v="
-videos["video_url"] =  URL_PREFIX + videos.index
-
-# =============================================================================
-# Convert YT categories
-# =============================================================================
-
-# Categories can be fetched from the API as well
-# id_dict = dict()
-# for item in response["items"]:
-#     id_dict.update({item["id"]: item["snippet"]["title"]})
-
-with open(project_path.joinpath("references", "youtube_categories.json"), 'r') as filepath:
-    categories_dict = json.load(filepath)
-
-videos["categoryId"] = videos["categoryId"].apply(str)
-videos["categoryId"].replace(categories_dict, inplace=True)
-
-# =============================================================================
-# Dataframe cleanups
-# =============================================================================
-
-comments["response_time_sec"] = comments["response_time"].dt.total_seconds()
-comments = comments.drop(columns=["response_time"], axis = 1)
-#comments = comments.set_index("comment_id")
-
-videos["removed_comments_perc"] = round(videos["removed_comments_perc"], 1)
-videos["likes_per_1kViews"] = round(videos["likes_per_1kViews"], 1)
-videos["comments_per_1kViews"] = round(videos["comments_per_1kViews"], 1)
-videos["responsivity"] = round(videos["responsivity"] * 100, 1)
-videos["duration"] = pd.to_timedelta(videos["duration"]).dt.total_seconds()
-
-convert_dict = {"mod_activity" : float,
-                "toplevel_sentiment_mean" : float,
-                "duration" : int}
-videos = videos.astype(convert_dict)
-
-# =============================================================================
-# Channel-wide features
-# =============================================================================
-
-# Get basic metrics
-channelIds = list(videos["videoOwnerChannelId"].unique())
-channels = pd.DataFrame()
-
-for channelId in channelIds:
-    _ = getChannelMetrics(channelId, first_key)[0]
-    _ = pd.DataFrame.from_dict(_, orient = "index").T
-    channels = pd.concat([channels, _], axis = 0)
-
-channels = channels.set_index("channelId")
-
-# Aggregate metrics from videos
-agg_dict = {
-      "video_url" : "size",
-      "commentCount" : "sum",
-      "available_comments" : "sum",
-      "removed_comments": "sum",
-      "likes_per_1kViews" : "mean",
-      "comments_per_1kViews": "mean",
-      "comments_per_author" : "mean",
-      "mean_word_count" : "mean",
-      "mod_activity": "mean",
-      "responsivity" : "mean",
-      "toplevel_sentiment_mean": "mean", # Note: simple average here, no weights
-      "ratio_RepliesToplevel" : "mean"
-}
-channels_metrics = videos.groupby("videoOwnerChannelId").agg(agg_dict)
-
-channels_metrics["removed_comments_perc"] = (
-     channels_metrics["removed_comments"] /
-    (channels_metrics["available_comments"] + channels_metrics["removed_comments"])
-)
-
-# Concat aggregated metrics
-channels = pd.concat([channels, channels_metrics], axis = 1)
-channels = channels.rename(columns = {"video_url":"n_videos"})
-
-
-# =============================================================================
-# Exports
-# DataFrames to csv, dtypes to json
-# =============================================================================
+channel_paths = [x for x in storage_path.iterdir() if x.is_dir()]
+print(f'found {len(channel_paths)} folders / channels.')
 
-# Channels
-channels.to_csv(processed_path.joinpath("channels.csv"), lineterminator="\r")
-exportDFdtypes(channels, "channels.json")
-
-# Videos
-videos.to_csv(processed_path.joinpath("videos.csv"), lineterminator="\r")
-exportDFdtypes(videos, "videos.json")
-
-# Comments
-comments.to_csv(processed_path.joinpath("comments.csv"), lineterminator="\r")
-exportDFdtypes(comments, "comments.json")
-
-## Excel export
-# Make datetime naive (unaware of timezone). Otherwise Excel export does not work
-channels["publishedAt"] = channels["publishedAt"].apply(lambda x: x.tz_localize(None))
-videos["publishedAt"] = videos["publishedAt"].apply(lambda x: x.tz_localize(None))
-channels.to_excel(processed_path.joinpath("Kanäle.xlsx"), 
-                                          sheet_name="Kanal", 
-                                          index_label = True)
-videos.to_excel(processed_path.joinpath("Videos.xlsx"), 
-                                         sheet_name="Video", 
-                                         index_label = True)
+manifest_file = processed_path.joinpath("transform_manifest.json")
+manifest = readManifest(manifest_file)
+code_fingerprint = fileFingerprint([Path(__file__), 
+                                    Path(__file__).parent.joinpath("src", "funcs.py"),
+                                    project_path.joinpath("references", "youtube_categories.json")],
+                                   content = True)
+
+full_run = (not incremental 
+            or manifest.get("code") != code_fingerprint
+            or not all(tableExists(processed_path.joinpath(table)) for table in ["channels", "videos", "comments"]))
+previous = dict() if full_run else manifest["channels"]
+
+fingerprints = {channel_path.name: channelFingerprint(channel_path) for channel_path in channel_paths}
+changed_paths = [channel_path for channel_path in channel_paths 
+                 if previous.get(channel_path.name, {}).get("fingerprint") != fingerprints[channel_path.name]]
+removed_channels = [name for name in previous if name not in fingerprints]
+print(f'{len(changed_paths)} channels to transform, {len(channel_paths) - len(changed_paths)} unchanged, '
+      f'{len(removed_channels)} removed')
+
+# Channels with comments and videos (others are skipped)
+complete_channels = [channel_path.name for channel_path in changed_paths 
+                     if channelHasComments(channel_path) and tableExists(channel_path.joinpath("all_videos"))]
+
+if full_run and not complete_channels:
+    print("no channel with comments and videos found, processed tables unchanged")
+
+elif changed_paths or removed_channels:
+    
+    comments_path = processed_path.joinpath("comments")
+    
+    # Rows of unchanged channels are kept
+    if full_run:
+        removeTable(comments_path)
+        all_channels, all_videos = [], []
+    else:
+        replaced_channelIds = [channelId 
+                               for name in [channel_path.name for channel_path in changed_paths] + removed_channels
+                               for channelId in previous.get(name, {}).get("channelIds", [])]
+        channels = readTable(processed_path.joinpath("channels"))
+        videos = readTable(processed_path.joinpath("videos"))
+        all_channels = [channels[~channels.index.isin(replaced_channelIds)]]
+        all_videos = [videos[~videos["videoOwnerChannelId"].isin(replaced_channelIds)]]
+        for name in removed_channels:
+            removeTable(comments_path.joinpath(name))
+    
+    comments_path.mkdir(exist_ok = True)
+    channel_manifest = {name: previous[name] for name in fingerprints if name in previous}
+    
+    for channel_path in changed_paths:
+        removeTable(comments_path.joinpath(channel_path.name))
+        channel_manifest[channel_path.name] = {"fingerprint": fingerprints[channel_path.name], "channelIds": []}
+        
+        if channel_path.name not in complete_channels:
+            print(f'{channel_path.name} | required tables not found, skipped')
+            continue
+        
+        channels, videos, comments = transformChannels([channel_path])
+        writeTable(comments, comments_path.joinpath(channel_path.name), csv = export_csv)
+        all_channels.append(channels)
+        all_videos.append(videos)
+        channel_manifest[channel_path.name]["channelIds"] = list(videos["videoOwnerChannelId"].unique())
+    
+    channels = pd.concat(all_channels, axis = 0)
+    videos = pd.concat(all_videos, axis = 0).sort_values("available_comments")
+    
+    # =============================================================================
+    # Exports
+    # DataFrames to parquet (dtypes embedded), optionally also csv + dtypes json
+    # =============================================================================
+    writeTable(channels, processed_path.joinpath("channels"), csv = export_csv)
+    writeTable(videos, processed_path.joinpath("videos"), csv = export_csv)
+    
+    # Manifest last (interrupted runs transform the changed channels again)
+    writeManifest({"code": code_fingerprint, "channels": channel_manifest}, manifest_file)
+    
+    ## Excel export
+    # Make datetime naive (unaware of timezone). Otherwise Excel export does not work
+    channels["publishedAt"] = channels["publishedAt"].apply(lambda x: x.tz_localize(None))
+    videos["publishedAt"] = videos["publishedAt"].apply(lambda x: x.tz_localize(None))
+    channels.to_excel(processed_path.joinpath("Kanäle.xlsx"), 
+                                              sheet_name="Kanal", 
+                                              index_label = True)
+    videos.to_excel(processed_path.joinpath("Videos.xlsx"), 
+                                             sheet_name="Video", 
+                                             index_label = True)
+
+else:
+    print("processed tables are up to date")
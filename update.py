@@ -1,36 +1,117 @@
 #!/usr/bin/env python3
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
-from src import storage_path, importDFdtypes
-from src import getVideoIds, getVideoStatistics, getCommentsFromVideos
-from src import first_key
+import threading
+from googleapiclient.errors import HttpError
+from src.funcs import storage_path, KeyPool, readTable, writeTable, appendTable
+from src.funcs import channelHasComments, readChannelComments, QuotaExhaustedError, classifyError
+from src.funcs import getVideoIds, getVideoStatistics, getNewComments
 
-# General question
-# Update the complete dataset? In theory, all videos can be commented at any time. Thus, everything
-# Can be updated 
+# =============================================================================
+# Incremental update of already fetched channels (data/interim/@channel)
+# 1) fetch videoIds of the upload playlist (new videos)
+# 2) refresh statistics of all videos (all_videos)
+# 3) fetch only comments newer than the latest stored comment per video
+# New comments are appended as part files to all_comments/. Afterwards run sentiment_analysis.py
+# (scores only the new comments) and transform.py as usual.
+# Refreshed commentCounts are stored only for videos whose new comments are stored,
+# thus failed videos are requested again in the next run. Updates stop once the 
+# quota of all API keys is exhausted.
+# =============================================================================
 
-# Import
-videos = pd.read_csv(storage_path.joinpath("videos.csv"), 
-                       index_col = 0, 
-                       lineterminator="\r")
-videos = videos.astype(importDFdtypes("videos"))
+key_pool = KeyPool.fromEnv()
+max_workers = 8
+requests_per_second = 10
 
-channels = pd.read_csv(storage_path.joinpath("channels.csv"), 
-                       index_col = 0, 
-                       lineterminator="\r")
-channels = channels.astype(importDFdtypes("channels"))
+channel_paths = [x for x in storage_path.iterdir() if x.is_dir()]
+quota_exhausted = threading.Event()
 
-# Check existing videoIds
-playlistIds = list(videos["playlistId"].unique())
-playlistId = playlistIds[0]
+for channel_path in channel_paths:
 
-playlistId_filter = videos["playlistId"] == playlistId
-existing_videoIds = list(videos[playlistId_filter].index)
+    if not channelHasComments(channel_path):
+        print(f'{channel_path.name} | no comments found, run fetch.py first')
+        continue
 
-# Check current videoId list
-fetched_videos = getVideoIds(playlistId, api_key_selector = first_key)
-fetched_videoIds = fetched_videos["videoId"]
+    # Import existing videos and latest stored comment per video
+    old_videos = readTable(channel_path.joinpath("all_videos"))
 
-new_videos = fetched_videos.query("~videoId.isin(@existing_videoIds)")
+    last_comments = readChannelComments(channel_path, columns = ["videoId", "comment_published"])
+    last_comments = last_comments.groupby("videoId")["comment_published"].max()
 
+    # Check current videoId list and refresh statistics of all videos
+    playlistId = old_videos["playlistId"].iloc[0]
+    raw_video_info = getVideoIds(playlistId, api_key_selector = key_pool)
+    raw_video_info = raw_video_info[~raw_video_info["videoOwnerChannelId"].isna()]
+    getVideoStatistics(raw_video_info, channel_path, api_key_selector = key_pool)
 
+    all_videos = readTable(channel_path.joinpath("all_videos"))
+
+    # Only videos with new comments (new videos or increased commentCount) are requested
+    old_commentCount = old_videos["commentCount"].reindex(all_videos.index).fillna(0)
+    changed_videos = (all_videos
+                      .query("commentCount.notnull()")
+                      .query("commentCount > @old_commentCount"))
+
+    new_videoIds = set(all_videos.index).difference(old_videos.index)
+    print(f'{channel_path.name} | {len(new_videoIds)} new videos, '
+          f'{len(changed_videos)} videos with new comments')
+
+    def storeVideos(fetched_videoIds):
+        """ Refreshed all_videos, videos with new comments not fetched yet keep their stored state """
+        pending = changed_videos.index.difference(fetched_videoIds)
+        videos = all_videos.drop(pending.difference(old_videos.index))
+        pending = pending.intersection(old_videos.index)
+        videos.loc[pending, "commentCount"] = old_videos.loc[pending, "commentCount"]
+        writeTable(videos, channel_path.joinpath("all_videos"))
+
+    # Until their comments are stored, changed videos are kept as before (crash safe)
+    storeVideos([])
+
+    def fetchNewComments(videoId):
+        if quota_exhausted.is_set():
+            return None
+        since = last_comments.get(videoId)
+        try:
+            return getNewComments(videoId, key_pool, since, requests_per_second)
+        except QuotaExhaustedError:
+            quota_exhausted.set()
+            print(f'Comment requests incomplete for {videoId} (quota exhausted)')
+        # No comments available (e.g. comments disabled), not requested again
+        except HttpError as error:
+            if classifyError(error) == "permanent":
+                return pd.DataFrame()
+            print(f'Comment requests incomplete for {videoId}')
+        except Exception:
+            print(f'Comment requests incomplete for {videoId}')
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        new_comments = dict(zip(changed_videos.index, executor.map(fetchNewComments, changed_videos.index)))
+
+    fetched_videoIds = [videoId for videoId, comments in new_comments.items() if comments is not None]
+    new_comments = [comments for comments in new_comments.values() if comments is not None and len(comments)]
+
+    if new_comments:
+        new_comments = pd.concat(new_comments, ignore_index = True)
+        new_comments["comment_published"] = pd.to_datetime(new_comments["comment_published"])
+        new_comments["comment_replies"] = pd.to_numeric(new_comments["comment_replies"], errors = "coerce")
+
+        # Augment video features (same as in fetch.py)
+        video_features = all_videos[["Title", "videoOwnerChannelTitle", "publishedAt"]]
+        new_comments = pd.merge(left = new_comments,
+                                right = video_features,
+                                how = "left",
+                                on = "videoId")
+        new_comments = new_comments.drop(["comment_update"], axis = 1)
+
+        # Appended as new part of the comments of the channel (stored comments are not rewritten)
+        table = channel_path.joinpath("all_comments")
+        appendTable(new_comments, table)
+        print(f'{channel_path.name} | {len(new_comments)} new comments appended to {table.name}/')
+
+    # Refreshed commentCount of videos whose comments are stored
+    storeVideos(fetched_videoIds)
+
+    if quota_exhausted.is_set():
+        print('Update NOT complete, quota of all API keys exhausted.')
+        break
@@ -3,7 +3,8 @@ import nltk
 import pandas as pd
 from wordcloud import WordCloud
 
-from src.funcs import project_path, storage_path, reports_path, processed_path
+from src.funcs import project_path, storage_path, reports_path, processed_path, readTable
+from src.funcs import readChannelComments
 
 # Gathering and defining stopwords prior to wordcloud creation 
 # Stopwords (common words with no/little meaning)
@@ -18,10 +19,8 @@ channel_paths = [x for x in storage_path.iterdir() if x.is_dir()]
 # Start generating wordclouds (loops through channel paths)
 for channel_path in channel_paths:
 
-    selected_comments_df = pd.read_csv(channel_path.joinpath("all_comments_withSentiment.csv"), 
-                                       index_col=0,
-                                       lineterminator="\r",
-                                       parse_dates=["publishedAt", "comment_published"])
+    selected_comments_df = readChannelComments(channel_path, 
+                                               columns=["videoOwnerChannelTitle", "comment_published", "comment_string"])
         
     channel_title = selected_comments_df["videoOwnerChannelTitle"][0]
     channel_foldername = channel_title.replace(" ", "_").replace("&", "_")
@@ -60,17 +59,18 @@ for channel_path in channel_paths:
         
 # Wordcloud for single video
 
-selected_comments_df = pd.read_csv(processed_path.joinpath("comments.csv"), 
-                                   index_col=0,
-                                   lineterminator="\r",
-                                   parse_dates=["publishedAt", "comment_published"])
+picked_videoId = "_5yP6rZKf9s"
 
-channel_title = selected_comments_df["videoOwnerChannelTitle"][0]
+# Only comments of the picked video are read (predicate pushdown)
+selected_comments_filtered = readTable(processed_path.joinpath("comments"), 
+                                       columns=["videoId", "Title", "videoOwnerChannelTitle", "comment_string"],
+                                       filters=[("videoId", "==", picked_videoId)],
+                                       parse_dates=["publishedAt", "comment_published"])
+
+channel_title = selected_comments_filtered["videoOwnerChannelTitle"].iloc[0]
 channel_foldername = channel_title.replace(" ", "_").replace("&", "_")
     
 
-picked_videoId = "_5yP6rZKf9s"
-selected_comments_filtered = selected_comments_df.query("videoId == @picked_videoId")
 video_title = selected_comments_filtered["Title"].iloc[1]
 video_title_short = video_title[:35]
 comments_for_wordcloud_filtered = selected_comments_filtered["comment_string"]